@@ -0,0 +1,118 @@
+"""
+Memory-mapped store of per-frame embeddings, see `assets.models.embed`.
+
+A store is a directory with `embeddings.f16`, a float16 (frames, dim) memory map, `index.csv` with
+the file_name and seq_id of every row and `meta.json` with the dimension, the model the embeddings
+come from and the number of rows written so far. Rows are appended in index order and that number
+only moves once they are flushed to disk, so an interrupted extraction resumes at the first row it
+did not write. Readers map the file read-only and gather the rows of some frames or sequences
+without loading the rest, converted to float32.
+Only depends on numpy and pandas so both the 1st and the 2nd Place scripts can use it.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+DATA, INDEX, META = "embeddings.f16", "index.csv", "meta.json"
+
+
+def _load_meta(path):
+    fname = os.path.join(path, META)
+    if not os.path.exists(fname):
+        return None
+    with open(fname) as f:
+        return json.load(f)
+
+
+def _save_meta(path, meta):
+    fname = os.path.join(path, META)
+    with open(fname + ".tmp", "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(fname + ".tmp", fname)
+
+
+class EmbeddingStore(object):
+    """
+    Args:
+        path (str): directory of the store
+        mode (str): "r" to read a complete store, "r+" to append to one made by `create`
+    Attributes:
+        index (pd.DataFrame): file_name and seq_id of every row
+        meta (dict): "dim", "written" rows and whatever else the store was created with
+        embeddings (np.memmap): (frames, dim) float16 rows
+    """
+
+    def __init__(self, path, mode="r"):
+        self.path = path
+        self.meta = _load_meta(path)
+        assert self.meta is not None, f"no embedding store at {path}"
+        self.index = pd.read_csv(os.path.join(path, INDEX))
+        assert mode != "r" or self.complete, f"{path}: only {self.written} of {len(self)} rows written"
+        self.embeddings = np.memmap(os.path.join(path, DATA), dtype=np.float16, mode=mode,
+                                    shape=(len(self.index), self.meta["dim"]))
+        self._positions = None
+
+    @classmethod
+    def create(cls, path, frames, dim, **meta):
+        """
+        Store for the `dim`-dimensional embeddings of `frames` (file_name and seq_id columns), with `meta` (json
+        serializable) in its meta.json. A store at `path` of the same frames and meta is opened as it is, so its
+        extraction resumes; any other one is overwritten.
+        """
+        os.makedirs(path, exist_ok=True)
+        index = frames[["file_name", "seq_id"]].reset_index(drop=True)
+        meta = json.loads(json.dumps({"dim": dim, **meta}))
+        existing = _load_meta(path)
+        if existing is not None and {k: v for k, v in existing.items() if k != "written"} == meta:
+            if pd.read_csv(os.path.join(path, INDEX)).equals(index):
+                return cls(path, mode="r+")
+        index.to_csv(os.path.join(path, INDEX), index=False)
+        np.memmap(os.path.join(path, DATA), dtype=np.float16, mode="w+", shape=(len(index), dim)).flush()
+        _save_meta(path, {**meta, "written": 0})
+        return cls(path, mode="r+")
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def dim(self):
+        return self.meta["dim"]
+
+    @property
+    def written(self):
+        return self.meta["written"]
+
+    @property
+    def complete(self):
+        return self.written == len(self)
+
+    def append(self, embeddings):
+        """ Writes `embeddings` as the next rows and records them once they are on disk """
+        start, end = self.written, self.written + len(embeddings)
+        assert end <= len(self), "more rows than frames"
+        self.embeddings[start:end] = embeddings
+        self.embeddings.flush()
+        self.meta["written"] = end
+        _save_meta(self.path, self.meta)
+
+    def rows(self, file_names):
+        """ Row of every one of `file_names`, which must all be in the store """
+        if self._positions is None:
+            self._positions = pd.Index(self.index.file_name)
+        rows = self._positions.get_indexer(file_names)
+        assert (rows >= 0).all(), f"{(rows < 0).sum()} frames missing from {self.path}"
+        return rows
+
+    def seq_rows(self, seq_ids):
+        """ Rows of all frames of the sequences `seq_ids`, in store order """
+        return np.flatnonzero(self.index.seq_id.isin(seq_ids).values)
+
+    def __getitem__(self, rows):
+        """ float32 embeddings of `rows`, read in ascending order and returned in the order asked for """
+        rows = np.asarray(rows)
+        order = np.argsort(rows, kind="stable")
+        out = np.empty((len(rows), self.dim), dtype=np.float32)
+        out[order] = self.embeddings[rows[order]]
+        return out
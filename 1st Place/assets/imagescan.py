@@ -0,0 +1,90 @@
+"""
+One-off validation of every image file, so loaders don't have to find bad files by trial and error.
+
+`scan` decodes every file once (at reduced resolution, which still reads all of the JPEG data
+and so catches truncated files) in parallel processes and records size, mtime and the error
+if any in a sqlite database. Files whose size and mtime did not change since the last scan are
+not decoded again, so re-running the scan only validates new and modified files. `bad_files`
+returns the files that failed, which the loaders then replace by a placeholder without any I/O.
+Only depends on the standard library and PIL.
+"""
+import logging
+import multiprocessing as mp
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+SCHEMA = "CREATE TABLE IF NOT EXISTS files (file_name TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, error TEXT)"
+
+
+def validate(fname):
+    """ None if `fname` decodes completely, the error message otherwise """
+    try:
+        with Image.open(fname) as img:
+            img.draft("RGB", (64, 48))
+            img.load()
+        return None
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def _stat(fname):
+    try:
+        st = os.stat(fname)
+        return st.st_size, st.st_mtime_ns
+    except OSError:
+        return -1, -1
+
+
+def _check(args):
+    file_name, fname = args
+    size, mtime_ns = _stat(fname)
+    error = "missing" if size < 0 else validate(fname)
+    return file_name, size, mtime_ns, error
+
+
+def connect(db):
+    con = sqlite3.connect(db)
+    con.execute(SCHEMA)
+    return con
+
+
+def scan(path, file_names, db, workers=os.cpu_count(), batch=10000):
+    """
+    Validates the files `file_names` (relative to `path`) that are new or changed since the last scan of `db`.
+    :return: number of files validated and number of bad files among all of `file_names`
+    """
+    con = connect(db)
+    known = {f: (size, mtime) for f, size, mtime in con.execute("SELECT file_name, size, mtime_ns FROM files")}
+    file_names = list(dict.fromkeys(file_names))
+    fnames = [os.path.join(path, f) for f in file_names]
+    # stat calls wait on the file system, threads overlap them
+    with ThreadPoolExecutor(32) as pool:
+        stats = list(pool.map(_stat, fnames, chunksize=256))
+    todo = [(f, fname) for f, fname, st in zip(file_names, fnames, stats) if known.get(f) != st]
+    logging.info(f"{len(todo)} new or changed files to validate")
+
+    rows = []
+    with mp.Pool(workers) as pool:
+        for i, row in enumerate(pool.imap_unordered(_check, todo, chunksize=64)):
+            rows.append(row)
+            if len(rows) == batch or i == len(todo) - 1:
+                con.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", rows)
+                con.commit()
+                logging.info(f"validated {i + 1}/{len(todo)}")
+                rows = []
+    bad = bad_files(db, file_names)
+    con.close()
+    return len(todo), len(bad)
+
+
+def bad_files(db, file_names=None):
+    """ file name -> error of every bad file recorded in `db` (among `file_names` if given) """
+    con = connect(db)
+    bad = dict(con.execute("SELECT file_name, error FROM files WHERE error IS NOT NULL"))
+    con.close()
+    if file_names is not None:
+        bad = {f: bad[f] for f in set(file_names) if f in bad}
+    return bad
@@ -0,0 +1,142 @@
+"Ensemble inference: every test batch is decoded once and shared by all member models."
+from fastai.vision import *
+from fastai.vision.image import _affine_grid, _grid_sample
+import contextlib
+from . import utils
+from .models import layout
+
+# `torch.inference_mode` is only available from torch 1.9
+inference_mode = getattr(torch, 'inference_mode', torch.no_grad)
+
+# Test-time views computed in memory from an already decoded NCHW batch
+TTA_VIEWS = {
+    'hflip': partial(torch.flip, dims=[3]),
+    'vflip': partial(torch.flip, dims=[2]),
+}
+
+
+class EnsembleMember():
+    "A named `model` taking part in the ensemble, scored on the original batch plus extra TTA `views`."
+    def __init__(self, name:str, model:nn.Module, views:Dict[str,str]=None):
+        self.name,self.model = name,model.eval()
+        self.views = ifnone(views, {})
+
+    @property
+    def names(self)->List[str]:
+        "Output names: the member itself followed by one per TTA view."
+        return [self.name] + list(self.views.values())
+
+    def __call__(self, xb:Tensor)->Tensor:
+        "Score `xb` and its TTA views in a single forward call, stacked along the batch dimension."
+        if not self.views: return self.model(xb)
+        return self.model(torch.cat([xb] + [TTA_VIEWS[v](xb) for v in self.views]))
+
+    def __repr__(self): return f'{self.__class__.__name__}({", ".join(self.names)})'
+
+
+def test_dl(df:pd.DataFrame, path:PathOrStr, size:Tuple[int,int]=(384,512), bs:int=32,
+            num_workers:int=defaults.cpus, stats:Tuple=imagenet_stats)->DeviceDataLoader:
+    "fastai batches of the images in `df.file_name` with the validation transforms, normalized with `stats`."
+    ll = ImageList.from_df(df, path=path, cols='file_name').split_none().label_empty().train
+    ll.transform(get_transforms()[1], size=size)
+    dl = DataLoader(ll, batch_size=bs, shuffle=False, num_workers=num_workers)
+    return DeviceDataLoader(dl, defaults.device, tfms=[normalize_funcs(*stats)[0]], collate_fn=data_collate)
+
+
+class ImageFileDataset(torch.utils.data.Dataset):
+    "Images in `fnames` as float CHW tensors of 0-255 pixel values, the whole frame squished to `size` (h,w) like fastai's `size=(h,w)`."
+    def __init__(self, fnames:Collection[PathOrStr], size:Tuple[int,int]=(384,512)):
+        self.fnames,self.size = list(fnames),size
+
+    def __len__(self): return len(self.fnames)
+
+    def __getitem__(self, i:int)->Tensor:
+        img = utils.open_pil_image(self.fnames[i], draft_size=utils.DRAFT_SIZE)
+        x = torch.from_numpy(np.array(img)).permute(2,0,1).float()
+        # fastai's own resampling of the validation transforms (`ResizeMethod.SQUISH`), which the models were trained on
+        return _grid_sample(x, _affine_grid((3,)+tuple(self.size)), mode='bilinear', padding_mode='reflection')
+
+
+class NormalizedBatches():
+    "Float batches of the 0-255 image batches of `dl` on `device`, in their memory layout, scaled to [0,1] and normalized with `stats`."
+    def __init__(self, dl:DataLoader, device:torch.device=None, stats:Tuple=imagenet_stats):
+        self.dl,self.device = dl,ifnone(device, defaults.device)
+        self.mean,self.std = [torch.tensor(s, device=self.device).view(1,-1,1,1) for s in stats]
+
+    def __len__(self): return len(self.dl)
+
+    def __iter__(self)->Iterator[Tuple[Tensor,None]]:
+        for xb in self.dl:
+            yield xb.to(self.device, non_blocking=True).float().div_(255).sub_(self.mean).div_(self.std), None
+
+
+def image_dl(df:pd.DataFrame, path:PathOrStr, size:Tuple[int,int]=(384,512), bs:int=32,
+             num_workers:int=defaults.cpus, stats:Tuple=imagenet_stats, channels_last:bool=False)->NormalizedBatches:
+    "Plain DataLoader of 0-255 batches of the images in `df.file_name`, normalized per batch on the device, NHWC if `channels_last`."
+    ds = ImageFileDataset([os.path.join(path, f) for f in df.file_name], size)
+    dl = DataLoader(ds, batch_size=bs, shuffle=False, num_workers=num_workers,
+                    collate_fn=layout.stack_channels_last if channels_last else torch.utils.data.dataloader.default_collate,
+                    pin_memory=defaults.device.type == 'cuda')
+    return NormalizedBatches(dl, stats=stats)
+
+
+def apply_tta_policy(members:Collection[EnsembleMember], policy:Dict[str,Dict[str,str]]):
+    "Set the TTA views of each of `members` from `policy`, a mapping {member: {view: output name}}."
+    for m in members:
+        m.views = dict(policy.get(m.name, {}))
+        for v in m.views: assert v in TTA_VIEWS, f'unknown TTA view {v}'
+
+
+def ensemble_preds(members:Collection[EnsembleMember], dl:Iterable, activ:Callable=torch.sigmoid,
+                   bf16:bool=False)->Dict[str,Tensor]:
+    "Run each (x,y) batch of `dl` through all `members`, so every image is decoded and resized only once."
+    preds = {n:[] for m in members for n in m.names}
+    autocast = torch.autocast('cpu', dtype=torch.bfloat16) if bf16 else contextlib.nullcontext()
+    with inference_mode(), autocast:
+        for xb,_ in progress_bar(dl):
+            for m in members:
+                out = activ(m(xb).float()).cpu()
+                for n,o in zip(m.names, out.split(len(xb))): preds[n].append(o)
+    return {k:torch.cat(v) for k,v in preds.items()}
+
+
+def uncertain(preds:np.ndarray, empty_idx:int, empty_band:Tuple[float,float], min_margin:float)->np.ndarray:
+    "Rows of `preds` whose empty probability lies inside `empty_band` or whose top-2 class margin is below `min_margin`."
+    top2 = np.partition(preds, -2, axis=1)[:,-2:]
+    margin = top2[:,1] - top2[:,0]
+    p_empty = preds[:,empty_idx]
+    return ((p_empty > empty_band[0]) & (p_empty < empty_band[1])) | (margin < min_margin)
+
+
+def log_loss(y_true:np.ndarray, y_pred:np.ndarray, eps:float=1e-15)->float:
+    "Aggregated binary log loss: summed over the classes and averaged over the rows."
+    p = np.clip(y_pred, eps, 1-eps)
+    return float(-np.mean(np.sum(y_true*np.log(p) + (1-y_true)*np.log(1-p), axis=1)))
+
+
+def seq_chunks(frames:pd.DataFrame, seq_ids:Collection, chunk_size:int)->Iterator[Tuple[pd.Index,pd.DataFrame]]:
+    "Split `frames` into consecutive chunks of `chunk_size` sequences, taken in the order of `seq_ids`."
+    seq_ids = pd.Index(seq_ids)
+    pos = seq_ids.get_indexer(frames.seq_id)
+    assert np.all(pos >= 0), 'frames of sequences missing from seq_ids'
+    chunk = pos // chunk_size
+    # stable sort keeps the frames of every chunk in their original order
+    order = np.argsort(chunk, kind='stable')
+    n_chunks = -(-len(seq_ids) // chunk_size)
+    bounds = np.searchsorted(chunk[order], np.arange(1, n_chunks))
+    for i,rows in enumerate(np.split(order, bounds)):
+        yield seq_ids[i*chunk_size:(i+1)*chunk_size], frames.iloc[rows]
+
+
+def seq_shards(frames:pd.DataFrame, n:int)->List[pd.DataFrame]:
+    "Split `frames` into at most `n` shards, keeping all frames of a sequence in the same shard."
+    shard = pd.factorize(frames.seq_id)[0] % n
+    return [frames[shard==k] for k in range(n) if (shard==k).any()]
+
+
+def blend(preds:Dict[str,Tensor], weights:Collection[Tuple[str,float]])->Tensor:
+    "Weighted sum of `preds`, accumulated in the order of `weights`."
+    res = None
+    for k,w in weights:
+        res = preds[k]*w if res is None else res + preds[k]*w
+    return res
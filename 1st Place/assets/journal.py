@@ -0,0 +1,109 @@
+"""
+Progress journal for chunked inference, so a killed run can resume where it stopped.
+
+The predictions are appended chunk by chunk to one output csv. After every chunk the output
+is flushed to disk and a json line with the chunk's seq_ids and the output size is appended
+to the journal. A restarted run skips the chunks already recorded, cuts the output back to the
+last recorded size and continues appending, so the final file is byte-identical to the one an
+uninterrupted run writes. The journal is tied to a fingerprint of the model weights and the
+inference config; a run with a different fingerprint starts from scratch.
+Only depends on the standard library so both the 1st and the 2nd Place inference scripts can use it.
+"""
+import hashlib
+import json
+import logging
+import os
+
+
+def file_checksum(fname, block_size=1 << 20):
+    """ sha256 of the content of `fname` """
+    digest = hashlib.sha256()
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint(files, config):
+    """ Checksum of the weight `files` together with a json-serializable inference `config` """
+    digest = hashlib.sha256()
+    for fname in files:
+        digest.update(file_checksum(fname).encode())
+    digest.update(json.dumps(config, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class InferenceJournal(object):
+    """
+    Args:
+        output (str): csv the chunks are appended to
+        fingerprint (str): see `fingerprint`, identifies the models and config of the run
+        fname (str): journal file, `output` + ".journal" by default
+    """
+
+    def __init__(self, output, fingerprint, fname=None):
+        self.output = output
+        self.fingerprint = fingerprint
+        self.fname = fname or output + ".journal"
+        self.entries = self._load()
+        if self.entries:
+            logging.info(f"Journal {self.fname}: {len(self.entries)} chunks already done.")
+
+    def _load(self):
+        if not (os.path.exists(self.fname) and os.path.exists(self.output)):
+            return []
+        entries = []
+        with open(self.fname) as f:
+            for n, line in enumerate(f):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # torn last line of a killed run
+                if n == 0:
+                    if entry.get("fingerprint") != self.fingerprint:
+                        logging.warning(f"Journal {self.fname} belongs to other models or config, starting over.")
+                        return []
+                    continue
+                entries.append(entry)
+        if entries and entries[-1]["offset"] > os.path.getsize(self.output):
+            logging.warning(f"{self.output} is shorter than recorded in {self.fname}, starting over.")
+            return []
+        return entries
+
+    def is_done(self, chunk, seq_ids):
+        """ Whether `chunk`, holding `seq_ids`, and every chunk before it were already written """
+        return chunk < len(self.entries) and self.entries[chunk]["seq_ids"] == [str(s) for s in seq_ids]
+
+    def start(self, chunk):
+        """
+        Prepares `output` for appending `chunk`: drops whatever was written after chunk - 1.
+        :return: True if the chunk goes to the beginning of the file (and so needs the header)
+        """
+        self.entries = self.entries[:chunk]
+        offset = self.entries[-1]["offset"] if self.entries else 0
+        with open(self.output, "ab") as f:
+            f.truncate(offset)
+        self._rewrite()
+        return offset == 0
+
+    def commit(self, chunk, seq_ids):
+        """ Records `chunk` as done, once its rows are appended to `output` """
+        with open(self.output, "ab") as f:
+            os.fsync(f.fileno())
+            offset = f.tell()
+        entry = {"chunk": chunk, "seq_ids": [str(s) for s in seq_ids], "offset": offset}
+        self.entries.append(entry)
+        with open(self.fname, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite(self):
+        tmp = self.fname + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(json.dumps({"fingerprint": self.fingerprint}) + "\n")
+            for entry in self.entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.fname)
@@ -0,0 +1,69 @@
+"""
+Frame budget per sequence: score only the `k` most informative frames of every sequence.
+
+Frames are ranked by their difference energy: the mean squared difference between a small
+grayscale thumbnail of the frame and the per-pixel median of the sequence's thumbnails,
+which approximates the static background. A frame with an animal moving through it differs
+most from that background. Thumbnails are mean-centered first so a change of exposure does
+not count as difference. JPEGs are decoded straight at a fraction of their resolution with
+`Image.draft`, so ranking costs a small part of a full decode.
+Only depends on numpy and PIL so both the 1st and the 2nd Place inference scripts can use it.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+# (width, height) of the thumbnails frames are compared on
+THUMB_SIZE = (32, 24)
+
+
+def thumbnail(fname, size=THUMB_SIZE):
+    """ (height, width) float32 grayscale thumbnail of `fname` in [0, 1], zeros if it can't be read """
+    try:
+        img = Image.open(fname)
+        img.draft("L", (size[0] * 2, size[1] * 2))
+        return np.asarray(img.convert("L").resize(size, Image.BILINEAR), dtype=np.float32) / 255
+    except Exception:
+        return np.zeros(size[::-1], dtype=np.float32)
+
+
+def energy(thumbs):
+    """ Difference energy of every one of the (n, height, width) `thumbs` of one sequence """
+    thumbs = np.asarray(thumbs, dtype=np.float32)
+    thumbs = thumbs - thumbs.mean(axis=(1, 2), keepdims=True)
+    background = np.median(thumbs, axis=0)
+    return ((thumbs - background) ** 2).mean(axis=(1, 2))
+
+
+def top_k(thumbs, k):
+    """ Indices of the `k` frames with the highest energy, in their original order (ties keep the earlier frame) """
+    assert k >= 1, f"a frame budget keeps at least 1 frame per sequence, got {k}"
+    if len(thumbs) <= k:
+        return np.arange(len(thumbs))
+    return np.sort(np.argsort(-energy(thumbs), kind="stable")[:k])
+
+
+def select(seq_ids, fnames, k, size=THUMB_SIZE, workers=8):
+    """
+    :param seq_ids: sequence id of every frame
+    :param fnames: image file of every frame
+    :param k: frames to keep per sequence
+    :param workers: threads decoding thumbnails (PIL releases the GIL while decoding)
+    :return: boolean mask of the frames to keep; only sequences longer than `k` are read at all
+    """
+    assert k >= 1, f"a frame budget keeps at least 1 frame per sequence, got {k}"
+    seq_ids, fnames = np.asarray(seq_ids), list(fnames)
+    order = np.argsort(seq_ids, kind="stable")
+    starts = np.flatnonzero(np.r_[True, seq_ids[order][1:] != seq_ids[order][:-1]])
+    groups = np.split(order, starts[1:])
+
+    keep = np.ones(len(seq_ids), dtype=bool)
+    long_groups = [g for g in groups if len(g) > k]
+    rows = np.concatenate(long_groups) if long_groups else np.zeros(0, dtype=np.int64)
+    with ThreadPoolExecutor(workers) as pool:
+        thumbs = dict(zip(rows, pool.map(lambda i: thumbnail(fnames[i], size), rows)))
+    for g in long_groups:
+        keep[g] = False
+        keep[g[top_k([thumbs[i] for i in g], k)]] = True
+    return keep
@@ -0,0 +1,54 @@
+"Per-chunk training manifests: image files plus a multi-hot label matrix over the fixed class list."
+from fastai.vision import *
+from .models.registry import CLASSES
+
+def chunk_manifest(manifest_dir:PathOrStr, chunk:int)->str:
+    "File name of the manifest of `chunk` in `manifest_dir`."
+    return os.path.join(manifest_dir, f'chunk_{chunk}.npz')
+
+def write_manifest(fname:PathOrStr, file_names:Collection[str], labels:np.ndarray, classes:Collection[str]=CLASSES):
+    "Save `file_names` with their (n, len(classes)) multi-hot `labels` to `fname`."
+    labels = np.asarray(labels, dtype=np.uint8)
+    assert labels.shape == (len(file_names), len(classes)), 'one multi-hot row per file'
+    np.savez(fname, file_names=np.asarray(file_names, dtype=str), labels=labels, classes=np.asarray(classes, dtype=str))
+
+def build_chunk_manifests(train_metadata:pd.DataFrame, train_labels:pd.DataFrame, chunks:pd.Series,
+                          manifest_dir:PathOrStr, classes:Collection[str]=CLASSES)->List[str]:
+    "Write one manifest per chunk of `chunks` (indexed by seq_id) with the frames of `train_metadata` and the labels of `train_labels`."
+    os.makedirs(manifest_dir, exist_ok=True)
+    chunk = chunks.reindex(train_metadata.seq_id).values
+    rows = train_labels.index.get_indexer(train_metadata.seq_id)
+    assert np.all(rows >= 0), 'frames of sequences without labels'
+    multi_hot = (train_labels[list(classes)].values > 0).astype(np.uint8)
+    fnames = []
+    for c in pd.unique(chunks.values):
+        sel = chunk == c
+        fnames.append(chunk_manifest(manifest_dir, c))
+        write_manifest(fnames[-1], train_metadata.file_name.values[sel], multi_hot[rows[sel]], classes)
+    return fnames
+
+class ManifestImageList(ImageList):
+    "`ImageList` of a manifest: items index its files and its multi-hot labels, so splitting keeps them aligned."
+    def __init__(self, items:Iterator, fnames:np.ndarray=None, multi_hot:np.ndarray=None, classes:Collection[str]=None, **kwargs):
+        super().__init__(items, **kwargs)
+        self.fnames,self.multi_hot,self.classes = fnames,multi_hot,classes
+        self.copy_new += ['fnames', 'multi_hot', 'classes']
+
+    @classmethod
+    def from_manifest(cls, fname:PathOrStr, path:PathOrStr='.', relocate:Callable=None, **kwargs)->'ManifestImageList':
+        "Load the manifest `fname`, its file names relative to `path`, optionally mapped through `relocate` first."
+        m = np.load(fname)
+        file_names = m['file_names'] if relocate is None else np.asarray(relocate(m['file_names']), dtype=str)
+        fnames = np.char.add(f'{path}{os.path.sep}', file_names)
+        return cls(np.arange(len(fnames)), fnames=fnames, multi_hot=m['labels'], classes=list(m['classes']),
+                   path=path, **kwargs)
+
+    def get(self, i):
+        res = self.open(self.fnames[self.items[i]])
+        self.sizes[i] = res.size
+        return res
+
+    def label_from_manifest(self, **kwargs)->'LabelList':
+        "Label every item with its multi-hot row of the manifest."
+        kwargs.update(label_cls=MultiCategoryList, classes=self.classes, one_hot=True)
+        return self._label_from_list(list(self.multi_hot[self.items]), **kwargs)
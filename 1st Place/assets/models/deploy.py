@@ -0,0 +1,85 @@
+"""
+Frozen TorchScript artifacts of the registered models, for deployment at their fixed input size.
+
+`compile_model` fixes the model to its input size (see `registry.static_model`), traces it on a
+batch of that size and freezes the trace: weights become constants, so TorchScript can fold and
+fuse around them. The traced graph keeps the batch size dynamic, so the last, smaller batch of a
+loader runs through the same artifact. `benchmark` reports the latency per batch of the dynamic
+EfficientNet (padding computed on every forward), the model as it was trained, the static model
+and the compiled one.
+"""
+import os
+import time
+
+import numpy as np
+import torch
+
+from . import efficientnets, registry
+
+
+def compile_model(model, image_size=registry.INPUT_SIZE, batch_size=32):
+    """ Frozen TorchScript of `model` traced on a batch of `batch_size` images of `image_size` (height, width) """
+    model = registry.static_model(model, image_size)
+    param = next(model.parameters())
+    example = torch.zeros(batch_size, 3, *image_size, dtype=param.dtype, device=param.device)
+    with torch.no_grad():
+        return torch.jit.freeze(torch.jit.trace(model, example))
+
+
+def artifact_path(name, model_dir='assets/models'):
+    return os.path.join(model_dir, name + '.ts')
+
+
+def export(name, model_dir='assets/models', batch_size=32):
+    """ Compiles the registered model `name` at its input size and saves it next to its weights """
+    spec = registry.REGISTRY[name]
+    compiled = compile_model(registry.load_model(name, model_dir, static=False), spec.input_size, batch_size)
+    fname = artifact_path(name, model_dir)
+    compiled.save(fname)
+    return fname
+
+
+def load_compiled(name, model_dir='assets/models', device='cpu'):
+    """ The artifact written by `export`, callable like the model """
+    return torch.jit.load(artifact_path(name, model_dir), map_location=device)
+
+
+def latency(model, x, iters=10):
+    """ Median seconds of a forward pass of `model` on `x`, after one warm-up pass """
+    times = []
+    with torch.no_grad():
+        for i in range(iters + 1):
+            start = time.perf_counter()
+            model(x)
+            if i > 0:
+                times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def benchmark(B='b1', batch_size=8, image_size=registry.INPUT_SIZE, iters=10):
+    """
+    Milliseconds per batch of EfficientNet-`B` (random weights, latency doesn't depend on them) with dynamic
+    padding, as trained (padding of the square pre-training size), static for `image_size` and compiled
+    :return: list of dicts, one per variant, with the largest absolute difference of its outputs to the dynamic model
+    """
+    torch.manual_seed(0)
+    trained = registry.efficientnet(B).eval()
+    dynamic = efficientnets.EfficientNet.from_name('efficientnet-' + B, override_params={'image_size': None})
+    dynamic.add_module('_fc', torch.nn.Linear(trained._fc.in_features, trained._fc.out_features))
+    dynamic.load_state_dict(trained.state_dict())
+    dynamic.eval()
+    static = registry.static_model(registry.efficientnet(B), image_size)
+    static.load_state_dict(trained.state_dict())
+    compiled = compile_model(static, image_size, batch_size)
+
+    x = torch.randn(batch_size, 3, *image_size)
+    with torch.no_grad():
+        ref = dynamic(x)
+    res, ms = [], {}
+    for variant, model in [('dynamic', dynamic), ('trained', trained), ('static', static), ('compiled', compiled)]:
+        with torch.no_grad():
+            diff = (model(x) - ref).abs().max().item()
+        ms[variant] = 1000 * latency(model, x, iters)
+        res.append({'arch': B, 'variant': variant, 'batch_size': batch_size, 'ms_per_batch': round(ms[variant], 1),
+                    'speedup': round(ms['dynamic'] / ms[variant], 2), 'max_abs_diff': diff})
+    return res
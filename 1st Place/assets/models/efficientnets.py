@@ -54,9 +54,10 @@ class SwishImplementation(torch.autograd.Function):
 
     @staticmethod
     def backward(ctx, grad_output):
-        i = ctx.saved_variables[0]
+        # under bfloat16 autocast `i` is bfloat16: the derivative is computed in fp32 and cast back
+        i = ctx.saved_tensors[0].float()
         sigmoid_i = torch.sigmoid(i)
-        return grad_output * (sigmoid_i * (1 + i * (1 - sigmoid_i)))
+        return (grad_output.float() * (sigmoid_i * (1 + i * (1 - sigmoid_i)))).to(grad_output.dtype)
 
 
 class MemoryEfficientSwish(nn.Module):
@@ -140,16 +141,18 @@ class Conv2dStaticSamePadding(nn.Conv2d):
 
         # Calculate padding based on image size and save it
         assert image_size is not None
-        ih, iw = image_size if type(image_size) == list else [image_size, image_size]
+        ih, iw = image_size if isinstance(image_size, (list, tuple)) else [image_size, image_size]
         kh, kw = self.weight.size()[-2:]
         sh, sw = self.stride
         oh, ow = math.ceil(ih / sh), math.ceil(iw / sw)
         pad_h = max((oh - 1) * self.stride[0] + (kh - 1) * self.dilation[0] + 1 - ih, 0)
         pad_w = max((ow - 1) * self.stride[1] + (kw - 1) * self.dilation[1] + 1 - iw, 0)
-        if pad_h > 0 or pad_w > 0:
-            self.static_padding = nn.ZeroPad2d((pad_w // 2, pad_w - pad_w // 2, pad_h // 2, pad_h - pad_h // 2))
-        else:
+        if pad_h % 2 == 0 and pad_w % 2 == 0:
+            # symmetric padding is left to the convolution itself, which saves a padded copy of the input
+            self.padding = (pad_h // 2, pad_w // 2)
             self.static_padding = Identity()
+        else:
+            self.static_padding = nn.ZeroPad2d((pad_w // 2, pad_w - pad_w // 2, pad_h // 2, pad_h - pad_h // 2))
 
     def forward(self, x):
         x = self.static_padding(x)
@@ -488,6 +491,35 @@ class EfficientNet(nn.Module):
             block.set_swish(memory_efficient)
 
 
+    def set_image_size(self, image_size):
+        """
+        Fixes the padding of every convolution for inputs of `image_size` (height, width), in place.
+        The padding is computed from the size of the feature map each convolution actually sees, so
+        no convolution pads on the fly any more. Inputs of any other size must not be used afterwards.
+        """
+        convs = [(parent, name, conv) for parent in self.modules() for name, conv in parent.named_children()
+                 if isinstance(conv, (Conv2dDynamicSamePadding, Conv2dStaticSamePadding))]
+        sizes = {}
+
+        def record(conv, inputs):
+            sizes[conv] = tuple(inputs[0].shape[-2:])
+
+        hooks = [conv.register_forward_pre_hook(record) for _, _, conv in convs]
+        param = next(self.parameters())
+        training = self.training
+        with torch.no_grad():
+            self.eval()(torch.zeros(1, 3, *image_size, dtype=param.dtype, device=param.device))
+        self.train(training)
+        for h in hooks:
+            h.remove()
+        for parent, name, conv in convs:
+            static = Conv2dStaticSamePadding(conv.in_channels, conv.out_channels, conv.kernel_size,
+                                             image_size=sizes[conv], stride=conv.stride, dilation=conv.dilation,
+                                             groups=conv.groups, bias=conv.bias is not None)
+            static.weight, static.bias = conv.weight, conv.bias
+            setattr(parent, name, static)
+        self._global_params = self._global_params._replace(image_size=tuple(image_size))
+
     def extract_features(self, inputs):
         """ Returns output of the final convolution layer """
 
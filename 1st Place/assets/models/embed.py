@@ -0,0 +1,67 @@
+"""
+Pooled backbone embeddings of the models, to train new classifiers on without running the backbones again.
+
+Every model here is a convolutional backbone followed by a global average pooling and a single
+`nn.Linear` classifier: `EfficientNet.extract_features` and `_fc`, the SE-ResNeXt50 of `registry.srx50`
+(the layers of `SENet.features` followed by a `Head` with its `fc`), `SENet.features` and `last_linear`,
+thunder_hammer's `ResNet.features` and `last_linear`, and the torchvision ResNeXts of the 2nd Place with
+their `fc`, also inside thunder_hammer's `*_ft` wrappers. `features` runs the backbone and the pooling,
+`classifier` returns the linear layer, so in eval mode `classifier(model)(features(model, x))` are the
+logits of `model`, which `check` asserts.
+Only depends on torch so both the 1st and the 2nd Place inference scripts can use it.
+"""
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+from . import efficientnets
+
+
+def _unwrap(model):
+    """ The network inside thunder_hammer's fine-tuning wrappers like `resnext101_32x8d_ft` """
+    return model.model if type(model).__name__.endswith('_ft') else model
+
+
+def backbone(model):
+    """ Function of an image batch returning the last feature map of `model`, in front of its global pooling """
+    model = _unwrap(model)
+    if isinstance(model, efficientnets.EfficientNet):
+        return model.extract_features
+    if hasattr(model, 'features'):
+        return model.features
+    if isinstance(model, nn.Sequential):
+        return model[0]
+    if hasattr(model, 'layer4') and hasattr(model, 'fc'):
+        # torchvision ResNet: everything but `avgpool` and `fc`
+        return nn.Sequential(*list(model.children())[:-2])
+    raise TypeError(f'no backbone known for {type(model).__name__}')
+
+
+def classifier(model):
+    """ The final `nn.Linear` of `model`, applied to its pooled features """
+    model = _unwrap(model)
+    for name in ['_fc', 'last_linear', 'fc']:
+        if isinstance(getattr(model, name, None), nn.Linear):
+            return getattr(model, name)
+    if isinstance(model, nn.Sequential) and isinstance(getattr(model[-1], 'fc', None), nn.Linear):
+        return model[-1].fc
+    raise TypeError(f'no classifier known for {type(model).__name__}')
+
+
+def embedding_dim(model):
+    return classifier(model).in_features
+
+
+@torch.no_grad()
+def features(model, x):
+    """ (N, C) embeddings of the batch `x`: the last feature map of `model`, average pooled """
+    return torch.flatten(F.adaptive_avg_pool2d(backbone(model)(x), 1), 1)
+
+
+@torch.no_grad()
+def check(model, x, rtol=1e-4, atol=1e-4):
+    """ Asserts that the classifier of `model` (in eval mode) on its embeddings of `x` gives the logits of `model` """
+    model = model.eval()
+    out, ref = classifier(model)(features(model, x)), model(x)
+    diff = (out - ref).abs().max().item()
+    assert torch.allclose(out, ref, rtol=rtol, atol=atol), f'classifier on the embeddings differs by up to {diff}'
@@ -0,0 +1,158 @@
+"""
+Folding of inference-mode BatchNorm into the preceding convolution.
+
+In eval mode a BatchNorm is a per-channel affine map, y = (x - mean) / sqrt(var + eps) * gamma + beta,
+so it can be merged into the weights and bias of the convolution that feeds it, saving one pass
+over every feature map. `fold_batchnorm` does this for every convolution that is directly followed
+by a BatchNorm among the children of a module, in registration order, which is the order these
+models apply them in: `MBConvBlock` and `EfficientNet` (efficientnets.py), `SEResNeXtBottleneck`
+and the SENet stem (pretrainedmodels.py), torchvision's ResNet/ResNeXt and thunder_hammer's
+`ResNet` with its `ABN` layers. Activated norms like `ABN` are replaced by their activation, plain
+BatchNorms by an identity. `check` compares a model with its folded copy, `benchmark` times both.
+`self_check` (python -m assets.models.fold) checks all of these architectures without weights or data.
+Only depends on torch so both the 1st and the 2nd Place inference scripts can use it.
+"""
+import copy
+import time
+
+import torch
+from torch import nn
+
+
+def is_norm(module):
+    """ BatchNorm2d, or a BatchNorm with a built-in activation like thunder_hammer's `ABN` """
+    return isinstance(module, nn.BatchNorm2d) or (
+        type(module).__name__ == 'ABN' and hasattr(module, 'running_var') and hasattr(module, 'activation'))
+
+
+def activation(norm):
+    """ Module applying what is left of `norm` once its normalization is folded away """
+    name = getattr(getattr(norm, 'activation', None), 'value', getattr(norm, 'activation', None))
+    if name is None or name == 'identity':
+        return nn.Identity()
+    if name == 'relu':
+        return nn.ReLU(inplace=True)
+    if name == 'leaky_relu':
+        return nn.LeakyReLU(norm.activation_param, inplace=True)
+    if name == 'elu':
+        return nn.ELU(norm.activation_param, inplace=True)
+    raise ValueError(f'cannot fold {type(norm).__name__} with activation {name}')
+
+
+@torch.no_grad()
+def fold_conv_bn(conv, norm):
+    """ Merges the running statistics and affine parameters of `norm` into `conv`, in place """
+    assert conv.out_channels == norm.running_mean.numel(), 'norm does not match the convolution'
+    scale = torch.rsqrt(norm.running_var + norm.eps)
+    if norm.weight is not None:
+        scale = scale * norm.weight
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(norm.running_mean)
+    bias = (bias - norm.running_mean) * scale
+    if norm.bias is not None:
+        bias = bias + norm.bias
+    conv.weight.mul_(scale.reshape(-1, 1, 1, 1).to(conv.weight.dtype))
+    conv.bias = nn.Parameter(bias.to(conv.weight.dtype))
+
+
+def fold_batchnorm(model):
+    """
+    Folds every norm that directly follows a convolution among the children of a module of `model` into it.
+    `model` is switched to eval mode and changed in place; it can no longer be trained afterwards.
+    :return: `model` and the number of folded norms
+    """
+    model.eval()
+    folded = 0
+    for module in list(model.modules()):
+        children = list(module.named_children())
+        for (_, conv), (name, norm) in zip(children, children[1:]):
+            if isinstance(conv, nn.Conv2d) and is_norm(norm) and conv.out_channels == norm.running_mean.numel():
+                fold_conv_bn(conv, norm)
+                setattr(module, name, activation(norm))
+                folded += 1
+    return model, folded
+
+
+@torch.no_grad()
+def check(model, x, rtol=1e-4, atol=1e-4):
+    """
+    Folds a copy of `model` and checks that its outputs on `x` match the original ones.
+    :return: the folded copy, the number of folded norms and the largest absolute difference
+    """
+    model = model.eval()
+    folded, n = fold_batchnorm(copy.deepcopy(model))
+    ref, out = model(x), folded(x)
+    diff = (out - ref).abs().max().item()
+    assert torch.allclose(out, ref, rtol=rtol, atol=atol), f'folded model differs by up to {diff}'
+    return folded, n, diff
+
+
+@torch.no_grad()
+def latency(model, x, iters=10):
+    """ Median seconds of a forward pass of `model` on `x`, after one warm-up pass """
+    times = []
+    for i in range(iters + 1):
+        start = time.perf_counter()
+        model(x)
+        if i > 0:
+            times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def benchmark(model, x, iters=10):
+    """ Milliseconds per batch `x` of `model` before and after folding, checked for equivalence first """
+    folded, n, diff = check(model, x)
+    before, after = latency(model.eval(), x, iters), latency(folded, x, iters)
+    return {'folded': n, 'max_abs_diff': diff, 'ms_per_batch': round(1000 * before, 1),
+            'folded_ms_per_batch': round(1000 * after, 1), 'speedup': round(before / after, 2)}
+
+
+@torch.no_grad()
+def randomize_norms(model, seed=0):
+    """ Random running statistics and affine parameters for every norm of `model`, in place, so that
+    folding them is not close to an identity like with freshly initialized ones """
+    gen = torch.Generator().manual_seed(seed)
+    for m in model.modules():
+        if is_norm(m):
+            n = m.running_mean.numel()
+            m.running_mean.copy_(0.1 * torch.randn(n, generator=gen))
+            m.running_var.copy_(0.5 + torch.rand(n, generator=gen))
+            if m.weight is not None:
+                m.weight.copy_(0.5 + torch.rand(n, generator=gen))
+                m.bias.copy_(0.1 * torch.randn(n, generator=gen))
+    return model
+
+
+def self_check_models():
+    """ (name, constructor) of randomly initialized models of every architecture `fold_batchnorm` is used on;
+    torchvision's and thunder_hammer's are left out when they are not installed """
+    from . import efficientnets, pretrainedmodels
+    models = [('efficientnet-b1', lambda: efficientnets.EfficientNet.from_name('efficientnet-b1')),
+              ('se_resnext50_32x4d body', lambda: nn.Sequential(*list(
+                  pretrainedmodels.se_resnext50_32x4d(num_classes=1000, pretrained=None).children())[:-2]))]
+    try:
+        from torchvision.models import resnext50_32x4d
+        models.append(('torchvision resnext50_32x4d', resnext50_32x4d))
+    except ImportError:
+        pass
+    try:
+        from thunder_hammer.model.classification.resnet import resnext50_32x4d as th_resnext50_32x4d
+        models.append(('thunder_hammer resnext50_32x4d (ABN)', th_resnext50_32x4d))
+    except ImportError:
+        pass
+    return models
+
+
+def self_check(x=None):
+    """ `check` of every model of `self_check_models`, with random norm statistics, on a random batch `x` """
+    x = torch.randn(2, 3, 96, 128) if x is None else x
+    results = []
+    for name, build in self_check_models():
+        _, n, diff = check(randomize_norms(build()), x)
+        assert n > 0, f'{name}: no norm folded'
+        results.append({'model': name, 'folded': n, 'max_abs_diff': diff})
+    return results
+
+
+if __name__ == '__main__':
+    for r in self_check():
+        print(r)
@@ -0,0 +1,66 @@
+"""
+channels_last (NHWC) execution of the models.
+
+oneDNN's CPU kernels for depthwise and grouped convolutions (MBConv blocks, ResNeXt 32x4d/32x8d)
+are considerably faster on NHWC memory. A model runs NHWC end to end when its weights and its
+input batch are both channels_last and every layer keeps that layout; a single layer returning
+NCHW makes every following convolution convert back and forth. `layout_breaks` runs a batch and
+lists the modules whose 4D output is not channels_last, `check` asserts there are none and
+`benchmark` compares the latency per batch in both layouts.
+Only depends on torch so both the 1st and the 2nd Place inference scripts can use it.
+"""
+import torch
+
+from .fold import latency
+
+
+def to_channels_last(model):
+    """ `model` with its 4D parameters and buffers in channels_last layout, in place """
+    return model.to(memory_format=torch.channels_last)
+
+
+def is_channels_last(t):
+    """ Whether the 4D tensor `t` is NHWC-contiguous; 1x1 feature maps are in both layouts """
+    return t.is_contiguous(memory_format=torch.channels_last)
+
+
+def stack_channels_last(images):
+    """ NHWC-contiguous batch of the CHW `images` (views of HWC arrays are stacked without reordering their pixels) """
+    return torch.stack([img.permute(1, 2, 0) for img in images]).permute(0, 3, 1, 2)
+
+
+@torch.no_grad()
+def layout_breaks(model, x):
+    """ Names of the modules of `model`, in execution order, whose 4D output on `x` in channels_last is NCHW """
+    breaks = []
+
+    def hook(name):
+        def record(module, inputs, output):
+            if isinstance(output, torch.Tensor) and output.dim() == 4 and not is_channels_last(output):
+                breaks.append(name)
+        return record
+
+    hooks = [m.register_forward_hook(hook(name)) for name, m in model.named_modules()]
+    try:
+        model(x.contiguous(memory_format=torch.channels_last))
+    finally:
+        for h in hooks:
+            h.remove()
+    return breaks
+
+
+def check(model, x):
+    """ Asserts that `model` (in channels_last) keeps the NHWC layout through all of its layers on `x` """
+    breaks = layout_breaks(model, x)
+    assert not breaks, f'{len(breaks)} modules return NCHW, starting with {breaks[:3]}'
+
+
+def benchmark(model, x, iters=10):
+    """ Milliseconds per batch `x` of `model` in NCHW and in channels_last, checked for layout breaks first """
+    model = model.eval()
+    nchw = latency(model, x.contiguous(), iters)
+    check(to_channels_last(model), x)
+    nhwc = latency(model, x.contiguous(memory_format=torch.channels_last), iters)
+    model.to(memory_format=torch.contiguous_format)
+    return {'ms_per_batch': round(1000 * nchw, 1), 'channels_last_ms_per_batch': round(1000 * nhwc, 1),
+            'speedup': round(nchw / nhwc, 2)}
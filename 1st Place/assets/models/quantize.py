@@ -0,0 +1,125 @@
+"""
+Static int8 post-training quantization of the models, for CPU serving.
+
+The models are quantized in FX graph mode: `prepare` traces a model, fuses its Conv2d+BatchNorm(+ReLU)
+sequences (in the SE blocks of SE-ResNeXt the squeeze convolution and its ReLU as well), puts a
+quantize node in front of the graph and a dequantize node behind it (the graph mode counterpart of
+QuantStub/DeQuantStub, without editing the model code) and observes the activations. The element-wise
+adds, swish and SE gate multiplications of the forward functions are quantized like the modules.
+`calibrate` runs a sample of real batches through the observers, `convert` swaps in the int8 kernels
+and `quantize_model` does all of it and returns a frozen TorchScript artifact, which runs without any
+of the model code: `save_int8` writes it along with its backend, `load_int8` loads it in the 1st Place
+predict.py as well as in the 2nd Place submit/main.py. `log_loss_deltas` and `benchmark` measure what
+the quantization costs and saves.
+Needs torch>=1.13 for `torch.ao.quantization`. Only depends on torch and numpy so both the 1st and
+the 2nd Place inference scripts can use it.
+"""
+import os
+
+import numpy as np
+import torch
+from torch import nn
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from . import efficientnets
+from .fold import latency
+
+# oneDNN runs the int8 depthwise convolutions of the EfficientNets about 3x faster than fbgemm (which the x86
+# backend picks for them), the grouped convolutions of the ResNeXts as fast; qnnpack on ARM
+BACKEND = next((b for b in ['onednn', 'x86', 'fbgemm'] if b in torch.backends.quantized.supported_engines), 'qnnpack')
+
+
+def quantizable(model):
+    """
+    `model` in eval mode with the convolutions of every EfficientNet in it as plain `nn.Conv2d`s (behind their
+    `nn.ZeroPad2d` if the padding is asymmetric) and the plain swish, in place, so the quantization can map
+    and fuse them. The EfficientNets must have a fixed input size, see `registry.static_model`.
+    """
+    for m in model.modules():
+        if isinstance(m, efficientnets.EfficientNet):
+            m.set_swish(memory_efficient=False)
+    for parent in list(model.modules()):
+        for name, conv in list(parent.named_children()):
+            assert not isinstance(conv, efficientnets.Conv2dDynamicSamePadding), 'fix the input size first'
+            if isinstance(conv, efficientnets.Conv2dStaticSamePadding):
+                plain = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, stride=conv.stride,
+                                  padding=conv.padding, dilation=conv.dilation, groups=conv.groups,
+                                  bias=conv.bias is not None)
+                plain.weight, plain.bias = conv.weight, conv.bias
+                pad = conv.static_padding
+                setattr(parent, name, plain if isinstance(pad, efficientnets.Identity) else nn.Sequential(pad, plain))
+    return model.eval()
+
+
+def prepare(model, example, backend=BACKEND, float_modules=()):
+    """
+    Fused copy of `model` with observers on its activations, for batches like `example`.
+    The modules named in `float_modules` (and everything inside them) are left in floating point.
+    """
+    torch.backends.quantized.engine = backend
+    qconfig_mapping = get_default_qconfig_mapping(backend)
+    for name in float_modules:
+        qconfig_mapping.set_module_name(name, None)
+    return prepare_fx(quantizable(model), qconfig_mapping, example_inputs=(example,))
+
+
+@torch.no_grad()
+def calibrate(prepared, batches):
+    """ Runs every batch of `batches` through the observers of `prepared` """
+    for xb in batches:
+        prepared(xb)
+    return prepared
+
+
+@torch.no_grad()
+def convert(prepared, example):
+    """ Frozen TorchScript of the int8 model of the calibrated `prepared`, traced on `example` """
+    return torch.jit.freeze(torch.jit.trace(convert_fx(prepared), example))
+
+
+def quantize_model(model, batches, example, backend=BACKEND, float_modules=()):
+    """
+    Static int8 TorchScript of `model` (changed in place), calibrated on `batches`.
+    The traced graph keeps the batch size dynamic; the image size is fixed to the one of `example`.
+    """
+    return convert(calibrate(prepare(model, example, backend, float_modules), batches), example)
+
+
+def int8_path(weights):
+    """ The int8 artifact of the model with the weight file `weights`, written next to it """
+    return os.path.splitext(str(weights))[0] + '.int8.ts'
+
+
+def save_int8(quantized, fname, backend=BACKEND):
+    """ Saves the artifact `quantized`, converted for `backend`, along with the name of that backend """
+    torch.jit.save(quantized, str(fname), _extra_files={'backend': backend})
+
+
+def load_int8(fname):
+    """ The artifact written by `save_int8`, callable like the model on CPU batches, run by its backend """
+    extra_files = {'backend': ''}
+    model = torch.jit.load(str(fname), map_location='cpu', _extra_files=extra_files)
+    torch.backends.quantized.engine = extra_files['backend'].decode() or BACKEND
+    return model
+
+
+def class_log_loss(y_true, y_pred, eps=1e-15):
+    """ Binary log loss of every class (column) of `y_pred`, averaged over the rows """
+    p = np.clip(y_pred, eps, 1 - eps)
+    return -np.mean(y_true * np.log(p) + (1 - y_true) * np.log(1 - p), axis=0)
+
+
+def log_loss_deltas(classes, y_true, float_preds, int8_preds):
+    """ Log loss of the float and of the int8 predictions, in total (summed over the classes) and per class """
+    before, after = class_log_loss(y_true, float_preds), class_log_loss(y_true, int8_preds)
+    return {'log_loss': round(float(before.sum()), 5), 'int8_log_loss': round(float(after.sum()), 5),
+            'log_loss_delta': round(float(after.sum() - before.sum()), 5),
+            'class_log_loss_delta': {c: round(float(d), 5) for c, d in zip(classes, after - before)}}
+
+
+def benchmark(model, quantized, x, iters=10):
+    """ Milliseconds per batch `x` of the float `model` and of its int8 artifact `quantized` """
+    before, after = latency(model.eval(), x, iters), latency(quantized, x, iters)
+    return {'ms_per_batch': round(1000 * before, 1), 'int8_ms_per_batch': round(1000 * after, 1),
+            'speedup': round(before / after, 2)}
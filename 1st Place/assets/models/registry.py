@@ -0,0 +1,119 @@
+"""
+Registry of the trained 1st Place models.
+
+Maps a model name to its architecture constructor, weight file, class list and input size,
+so inference can build plain `nn.Module`s straight from `assets/models/*.pth` without
+creating a fastai `Learner` or reading any training metadata.
+"""
+import collections
+import os
+
+import torch
+from torch import nn
+
+from . import efficientnets
+from . import fold
+from . import layout
+from . import pretrainedmodels
+from ..utils import Head
+
+# Multi-label vocabulary of all models, in fastai's (sorted) class order
+CLASSES = [
+    'aardvark', 'aardwolf', 'baboon', 'bat', 'batearedfox', 'buffalo', 'bushbuck', 'caracal', 'cattle',
+    'cheetah', 'civet', 'dikdik', 'duiker', 'eland', 'elephant', 'empty', 'gazellegrants', 'gazellethomsons',
+    'genet', 'giraffe', 'guineafowl', 'hare', 'hartebeest', 'hippopotamus', 'honeybadger', 'hyenaspotted',
+    'hyenastriped', 'impala', 'insectspider', 'jackal', 'koribustard', 'leopard', 'lionfemale', 'lionmale',
+    'mongoose', 'monkeyvervet', 'ostrich', 'otherbird', 'porcupine', 'reedbuck', 'reptiles', 'rhinoceros',
+    'rodents', 'secretarybird', 'serval', 'steenbok', 'topi', 'vulture', 'warthog', 'waterbuck', 'wildcat',
+    'wildebeest', 'zebra', 'zorilla',
+]
+
+# Input size (height, width) all models were trained on
+INPUT_SIZE = (384, 512)
+
+ModelSpec = collections.namedtuple('ModelSpec', ['arch', 'weights', 'classes', 'input_size'])
+
+
+def efficientnet(B, num_classes=len(CLASSES)):
+    """ EfficientNet-`B` with the classifier used by the training scripts """
+    FC = {"b1": 1280, "b3": 1536}
+    model = efficientnets.EfficientNet.from_name('efficientnet-' + B)
+    model.add_module('_fc', nn.Linear(FC[B], num_classes))
+    return model
+
+
+def srx50(num_classes=len(CLASSES)):
+    """ SE-ResNeXt50 laid out like fastai's `cnn_learner(get_srx50, cut=-2, custom_head=Head(2048, c))` """
+    body = pretrainedmodels.se_resnext50_32x4d(num_classes=1000, pretrained=None)
+    body = nn.Sequential(*list(body.children())[:-2])
+    return nn.Sequential(body, Head(512 * 4, num_classes, 0.0))
+
+
+REGISTRY = collections.OrderedDict()
+
+
+def register(name, arch, weights=None, classes=CLASSES, input_size=INPUT_SIZE):
+    """ Registers `name`, built by `arch(num_classes)` and loaded from `weights` (default: `name`.pth) """
+    REGISTRY[name] = ModelSpec(arch, weights or name + '.pth', list(classes), input_size)
+
+
+register('model_b3', lambda c: efficientnet('b3', c))
+register('model_b1_season10', lambda c: efficientnet('b1', c))
+register('best-sat-0075', srx50)
+register('best-thu', srx50)
+register('model_srx50', srx50)
+# weight average of the three SE-ResNeXt50 checkpoints, written by make_soup.py
+register('soup_srx50', srx50)
+
+
+def weights_path(name, model_dir='assets/models'):
+    return os.path.join(model_dir, REGISTRY[name].weights)
+
+
+def load_state_dict(fname):
+    """ Model weights of a checkpoint written by `Learner.save` (with or without the optimizer state) """
+    state = torch.load(fname, map_location='cpu')
+    if set(state.keys()) == {'model', 'opt'}:
+        state = state['model']
+    return state
+
+
+def static_model(model, image_size=INPUT_SIZE):
+    """
+    `model` in eval mode with every EfficientNet in it fixed to inputs of `image_size` (height, width), in place:
+    paddings computed once for the feature map sizes at `image_size` and the plain swish instead of the
+    autograd function, which inference doesn't need and tracing can't see through
+    """
+    for m in model.modules():
+        if isinstance(m, efficientnets.EfficientNet):
+            m.set_image_size(image_size)
+            m.set_swish(memory_efficient=False)
+    return model.eval()
+
+
+def int8_path(name, model_dir='assets/models'):
+    # imported here: torch.ao.quantization needs torch>=1.13, inference with the float models doesn't
+    from . import quantize
+    return quantize.int8_path(weights_path(name, model_dir))
+
+
+def load_model(name, model_dir='assets/models', device='cpu', static=True, fold_bn=True, channels_last=False,
+               int8=False):
+    """
+    Builds the registered model `name` and loads its weights, ready for inference: at its input size if `static`,
+    with the BatchNorms folded into the convolutions if `fold_bn`, for NHWC batches if `channels_last`.
+    With `int8` it loads the int8 artifact written by quantize_models.py instead, which only runs on the CPU.
+    """
+    if int8:
+        from . import quantize
+        return quantize.load_int8(int8_path(name, model_dir))
+    spec = REGISTRY[name]
+    model = spec.arch(len(spec.classes))
+    model.load_state_dict(load_state_dict(weights_path(name, model_dir)))
+    if static:
+        static_model(model, spec.input_size)
+    if fold_bn:
+        fold.fold_batchnorm(model)
+    if channels_last:
+        layout.to_channels_last(model)
+    return model.to(device).eval()
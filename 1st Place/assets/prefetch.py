@@ -0,0 +1,123 @@
+"""
+Background prefetch of the next training chunk.
+
+The chunked training scripts train on one chunk of seasons after the other, in the order of
+`train_in_chunks_per_season.csv`. While chunk k trains, `ChunkPrefetcher` reads the files of
+chunk k + 1 in background threads, up to a byte budget, so they are in the page cache (or,
+with a staging directory, copied to fast local storage) by the time chunk k + 1 starts.
+When a chunk starts, the prefetcher waits for whatever of its prefetch is still running and
+logs how long the background reads took against how long training had to wait for them.
+Only depends on the standard library.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ChunkPrefetcher(object):
+    """
+    Args:
+        path (str): root the file names are relative to
+        file_names (pd.Series): file name of every training frame, indexed by seq_id
+        chunks (pd.Series): chunk of every sequence, indexed by seq_id, in training order
+        budget (int): bytes read ahead per chunk, None for no limit
+        staging_dir (str): copy the files there instead of only reading them, see `locate`
+        workers (int): parallel reads, network storage needs several to be saturated
+    """
+
+    def __init__(self, path, file_names, chunks, budget=None, staging_dir=None, workers=8):
+        self.path = str(path)
+        self.order = list(dict.fromkeys(chunks.values))
+        chunk_of = chunks.reindex(file_names.index).values
+        self.files = {c: list(file_names.values[chunk_of == c]) for c in self.order}
+        self.budget = budget
+        self.staging_dir = staging_dir
+        self.workers = workers
+        self.jobs = {}
+
+    def start(self, chunk):
+        """ Called when training on `chunk` starts: waits for its prefetch and starts the one of the next chunk """
+        job = self.jobs.get(chunk)
+        if job is not None and not job["reported"]:
+            start = time.perf_counter()
+            job["thread"].join()
+            stall = time.perf_counter() - start
+            job["reported"] = True
+            logging.info(f"prefetch chunk {chunk}: {job['files']} files, {job['bytes'] / 2**30:.2f} GB "
+                         f"read in {job['seconds']:.0f}s in the background, waited {stall:.0f}s for it, "
+                         f"~{max(job['seconds'] - stall, 0):.0f}s of I/O stall saved")
+        if self.staging_dir is not None:
+            self._evict(keep=[chunk, self._next(chunk)])
+        nxt = self._next(chunk)
+        if nxt is not None and nxt not in self.jobs:
+            self._prefetch(nxt)
+
+    def locate(self, file_names):
+        """
+        `file_names` with every file that has been staged replaced by its staged copy.
+        The paths stay relative to `path`, since fastai's image lists prefix them with it.
+        """
+        staged = self.staged()
+        return [os.path.relpath(staged[f], self.path) if f in staged else f for f in file_names]
+
+    def staged(self):
+        """ File name -> absolute path of its staged copy """
+        return {f: os.path.join(os.path.abspath(self.staging_dir), f)
+                for job in self.jobs.values() for f in job["staged"]}
+
+    def _next(self, chunk):
+        i = self.order.index(chunk)
+        return self.order[i + 1] if i + 1 < len(self.order) else None
+
+    def _prefetch(self, chunk):
+        job = {"files": 0, "bytes": 0, "seconds": 0.0, "staged": [], "reported": False}
+        lock = threading.Lock()
+
+        def read(fname):
+            src = os.path.join(self.path, fname)
+            with lock:
+                if self.budget is not None and job["bytes"] >= self.budget:
+                    return
+            try:
+                if self.staging_dir is not None:
+                    dst = os.path.join(self.staging_dir, fname)
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    shutil.copyfile(src, dst)
+                    size = os.path.getsize(dst)
+                else:
+                    size = 0
+                    with open(src, "rb") as f:
+                        for block in iter(lambda: f.read(1 << 20), b""):
+                            size += len(block)
+            except OSError:
+                return
+            with lock:
+                job["files"] += 1
+                job["bytes"] += size
+                if self.staging_dir is not None:
+                    job["staged"].append(fname)
+
+        def run():
+            start = time.perf_counter()
+            with ThreadPoolExecutor(self.workers) as pool:
+                list(pool.map(read, self.files[chunk]))
+            job["seconds"] = time.perf_counter() - start
+
+        job["thread"] = threading.Thread(target=run, name=f"prefetch-chunk-{chunk}", daemon=True)
+        self.jobs[chunk] = job
+        job["thread"].start()
+
+    def _evict(self, keep):
+        for chunk, job in self.jobs.items():
+            if chunk in keep or not job["staged"]:
+                continue
+            job["thread"].join()
+            for fname in job["staged"]:
+                try:
+                    os.remove(os.path.join(self.staging_dir, fname))
+                except OSError:
+                    pass
+            job["staged"] = []
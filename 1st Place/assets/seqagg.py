@@ -0,0 +1,79 @@
+"""
+Sequence-level aggregation of frame predictions.
+
+Frames are sorted by seq_id once, after which every reduction is a single `reduceat`
+over contiguous segments. Geometric means are computed as sums in log space, so long
+sequences do not underflow the way `group.product() ** (1 / len(group))` does.
+Only depends on numpy so both the 1st and the 2nd Place inference scripts can use it.
+"""
+import numpy as np
+
+REDUCTIONS = ("mean", "gmean", "max")
+
+
+class SeqAggregator(object):
+    """
+    Aggregates frame-level rows into one row per sequence.
+    Args:
+        seq_ids (array-like): sequence id of every frame, in any order
+    Attributes:
+        seq_ids (np.ndarray): unique sequence ids, sorted, matching the output rows
+        counts (np.ndarray): number of frames in every sequence
+    """
+
+    def __init__(self, seq_ids):
+        seq_ids = np.asarray(seq_ids)
+        self.order = np.argsort(seq_ids, kind="stable")
+        sorted_ids = seq_ids[self.order]
+        is_start = np.ones(len(sorted_ids), dtype=bool)
+        is_start[1:] = sorted_ids[1:] != sorted_ids[:-1]
+        self.starts = np.flatnonzero(is_start)
+        self.seq_ids = sorted_ids[self.starts]
+        self.counts = np.diff(np.append(self.starts, len(sorted_ids)))
+        self._identity = bool(np.all(self.order == np.arange(len(self.order))))
+        # output row of every frame, in the original frame order
+        self.inverse = np.empty(len(seq_ids), dtype=np.int64)
+        self.inverse[self.order] = np.repeat(np.arange(len(self.starts)), self.counts)
+
+    def __len__(self):
+        return len(self.seq_ids)
+
+    def __call__(self, values, how=REDUCTIONS):
+        """
+        :param values: (n_frames, n_classes) frame predictions, rows aligned with `seq_ids`
+        :param how: reductions to compute, any of "mean", "gmean" and "max"
+        :return: dict reduction -> (n_sequences, n_classes) array, rows ordered like `self.seq_ids`
+        """
+        values = np.asarray(values)
+        assert len(values) == len(self.order), "values and seq_ids must have the same length"
+        for h in how:
+            assert h in REDUCTIONS, f"unknown reduction {h}"
+        x = values if self._identity else values[self.order]
+        counts = self.counts.reshape((-1,) + (1,) * (x.ndim - 1))
+
+        out = {}
+        if "mean" in how:
+            out["mean"] = np.add.reduceat(x, self.starts, axis=0, dtype=np.float64) / counts
+        if "gmean" in how:
+            with np.errstate(divide="ignore"):
+                logs = np.log(x, dtype=np.float64)
+            out["gmean"] = np.exp(np.add.reduceat(logs, self.starts, axis=0) / counts)
+        if "max" in how:
+            out["max"] = np.maximum.reduceat(x, self.starts, axis=0)
+        return {k: v.astype(values.dtype, copy=False) for k, v in out.items()}
+
+    def expand(self, seq_values):
+        """ Broadcasts per-sequence rows (ordered like `self.seq_ids`) back to one row per frame """
+        return np.asarray(seq_values)[self.inverse]
+
+    def combine(self, values, how="mean", per_class=None):
+        """
+        Aggregates every class with `how`, except the classes (column indices) listed in
+        `per_class`, a dict column -> reduction. All reductions come out of the same pass.
+        """
+        per_class = per_class or {}
+        res = self(values, how=set([how]) | set(per_class.values()))
+        out = res[how]
+        for col, h in per_class.items():
+            out[:, col] = res[h][:, col]
+        return out
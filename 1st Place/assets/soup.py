@@ -0,0 +1,72 @@
+"""
+Weight-space ensembling ("model soup") of checkpoints sharing one architecture.
+
+The parameters of the checkpoints are averaged with optional per-checkpoint coefficients,
+giving a single model that costs one forward pass instead of one per checkpoint. Averaged
+weights do not match the BatchNorm running statistics of any of the checkpoints, so they
+are recomputed afterwards on a small calibration sample of images.
+"""
+import torch
+from torch import nn
+
+from .models import registry
+
+
+def average_state_dicts(states, coefs=None):
+    """
+    :param states: list of state dicts with the same keys and shapes
+    :param coefs: weight of every state dict, normalized to sum to 1 (default: uniform)
+    :return: state dict with the weighted average of every floating point tensor; integer
+        buffers (BatchNorm's num_batches_tracked) are taken from the first state dict
+    """
+    coefs = [1.0] * len(states) if coefs is None else list(coefs)
+    assert len(coefs) == len(states), "one coefficient per checkpoint"
+    assert sum(coefs) > 0, "coefficients must not sum to 0"
+    coefs = [c / sum(coefs) for c in coefs]
+    keys = list(states[0].keys())
+    for state in states[1:]:
+        assert list(state.keys()) == keys, "checkpoints have different parameters"
+
+    soup = {}
+    for k in keys:
+        tensors = [state[k] for state in states]
+        for t in tensors[1:]:
+            assert t.shape == tensors[0].shape, f"{k}: shapes differ"
+        if tensors[0].is_floating_point():
+            soup[k] = sum(c * t.double() for c, t in zip(coefs, tensors)).to(tensors[0].dtype)
+        else:
+            soup[k] = tensors[0].clone()
+    return soup
+
+
+def make_soup(names, coefs=None, model_dir="assets/models"):
+    """ Model with the averaged weights of the registered models `names`, which must share one architecture """
+    specs = [registry.REGISTRY[n] for n in names]
+    for n, spec in zip(names, specs):
+        assert (spec.arch, spec.classes, spec.input_size) == (specs[0].arch, specs[0].classes, specs[0].input_size), \
+            f"{n} and {names[0]} have different architectures"
+    states = [registry.load_state_dict(registry.weights_path(n, model_dir)) for n in names]
+    model = specs[0].arch(len(specs[0].classes))
+    model.load_state_dict(average_state_dicts(states, coefs))
+    return model.eval()
+
+
+def recalibrate_bn(model, batches, device="cpu"):
+    """
+    Recomputes the running mean and variance of every BatchNorm layer of `model` as the plain
+    average over the (x, y) `batches`, the rest of the model stays in eval mode.
+    """
+    bns = [m for m in model.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm)]
+    momenta = [bn.momentum for bn in bns]
+    model.to(device).eval()
+    for bn in bns:
+        bn.reset_running_stats()
+        # cumulative moving average, every batch counts the same
+        bn.momentum = None
+        bn.train()
+    with torch.no_grad():
+        for xb, _ in batches:
+            model(xb.to(device))
+    for bn, momentum in zip(bns, momenta):
+        bn.momentum = momentum
+    return model.eval()
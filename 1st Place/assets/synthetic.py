@@ -0,0 +1,138 @@
+"""
+Synthetic Serengeti-like training corpus, to measure training throughput without the real dataset.
+
+`make_corpus` writes camera-trap-like JPEGs laid out like the real data
+(`S<season>/<site>/<site>_R<roll>/S<season>_<site>_R<roll>_IMAG<n>.JPG`) together with
+`train_metadata.csv`, `train_labels.csv`, `train_metadata_with_labels.csv` and
+`train_in_chunks_per_season.csv` in the formats the training scripts read. Sequences mostly
+hold three frames, as the camera traps fire bursts of three, and about three quarters of
+them are empty with the animal classes falling off like a power law, as in the real labels.
+Frames of a sequence share a smooth background with sensor noise, which compresses to about
+the size of the real photos; frames with an animal add a blob moving across the sequence.
+Labels are multi-hot over the class vocabulary the caller passes in, `registry.CLASSES` for the
+training scripts. Only depends on numpy, pandas and PIL.
+"""
+import logging
+import multiprocessing as mp
+import os
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from . import seqlabels
+
+# the most frequent animals first (those of them in the vocabulary), the rest of the classes follow in random order
+COMMON = ['wildebeest', 'zebra', 'gazellethomsons', 'buffalo', 'hartebeest', 'elephant', 'impala', 'giraffe']
+
+# (frames per sequence, probability)
+SEQ_LENGTHS = [(1, 0.08), (2, 0.04), (3, 0.84), (4, 0.02), (6, 0.01), (9, 0.01)]
+
+# fraction of empty sequences and of animal sequences with a second class
+EMPTY_FRACTION = 0.75
+MULTI_FRACTION = 0.02
+
+# (width, height) and JPEG quality of the real photos
+IMAGE_SIZE = (2048, 1536)
+QUALITY = 85
+
+
+def class_frequencies(classes, rng):
+    """ Probability of every animal class (all `classes` but 'empty') of an animal sequence, Zipf-like """
+    animals = [c for c in classes if c != 'empty']
+    rest = [c for c in animals if c not in COMMON]
+    order = [c for c in COMMON if c in animals] + list(rng.permutation(rest))
+    p = 1.0 / np.arange(1, len(order) + 1) ** 1.3
+    return pd.Series(p / p.sum(), index=order).reindex(animals)
+
+
+def sequences(classes, n_seqs, seasons, seed=0):
+    """
+    :param classes: label vocabulary in column order, with an 'empty' class
+    :return: (metadata, labels): one row per frame with seq_id and file_name, one row per sequence with
+        the 0/1 columns of `classes` indexed by seq_id
+    """
+    classes = list(classes)
+    rng = np.random.RandomState(seed)
+    lengths, p = zip(*SEQ_LENGTHS)
+    freq = class_frequencies(classes, rng)
+    season = np.sort(rng.choice(seasons, n_seqs))
+    labels = np.zeros((n_seqs, len(classes)), dtype=np.int64)
+    empty = rng.rand(n_seqs) < EMPTY_FRACTION
+    labels[empty, classes.index('empty')] = 1
+    for i in np.flatnonzero(~empty):
+        n = 2 if rng.rand() < MULTI_FRACTION else 1
+        for c in rng.choice(freq.index, n, replace=False, p=freq.values):
+            labels[i, classes.index(c)] = 1
+
+    seq_ids, file_names = [], []
+    images = {}
+    for i, s in enumerate(season):
+        site = f"{'BCDEFGHIJ'[rng.randint(9)]}{rng.randint(1, 14):02d}"
+        roll = rng.randint(1, 4)
+        seq_id = f"SER_{s}#{site}#{roll}#{i}"
+        for _ in range(rng.choice(lengths, p=p)):
+            key = (s, site, roll)
+            images[key] = images.get(key, 0) + 1
+            seq_ids.append(seq_id)
+            file_names.append(f"{s}/{site}/{site}_R{roll}/{s}_{site}_R{roll}_IMAG{images[key]:04d}.JPG")
+    ids = pd.Index(pd.unique(pd.Series(seq_ids)), name="seq_id")
+    return (pd.DataFrame({"seq_id": seq_ids, "file_name": file_names}),
+            pd.DataFrame(labels, index=ids, columns=classes))
+
+
+def render(background, animal, t, size, seed):
+    """ One frame: `background` upscaled to `size`, sensor noise and, if `animal`, a blob at position `t` in [0, 1] """
+    rng = np.random.default_rng(seed)
+    img = np.asarray(Image.fromarray(background).resize(size, Image.BICUBIC), dtype=np.float32)
+    if animal:
+        w, h = size
+        cx, cy, r = int(w * (0.2 + 0.6 * t)), int(h * 0.6), int(h * 0.12)
+        # the blob is negligible beyond 3 radii, only that box is touched
+        y0, y1, x0, x1 = max(cy - 3 * r, 0), min(cy + 3 * r, h), max(cx - 3 * r, 0), min(cx + 3 * r, w)
+        yy, xx = np.ogrid[y0 - cy:y1 - cy, x0 - cx:x1 - cx]
+        blob = np.exp(-((xx / r) ** 2 + (yy / (0.6 * r)) ** 2)).astype(np.float32)[..., None]
+        box = img[y0:y1, x0:x1]
+        box += blob * (np.array([90, 70, 50], dtype=np.float32) - box)
+    img += 6 * rng.standard_normal(img.shape[:2], dtype=np.float32)[..., None]
+    return Image.fromarray(np.clip(img, 0, 255).astype(np.uint8))
+
+
+def _write_sequence(args):
+    path, file_names, animal, size, quality, seed = args
+    rng = np.random.RandomState(seed)
+    # coarse savanna-coloured field, upscaled smoothly to the full size
+    background = (rng.rand(12, 16, 3) * [60, 60, 50] + [110, 100, 70]).astype(np.uint8)
+    for j, f in enumerate(file_names):
+        fname = os.path.join(path, f)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        t = j / max(len(file_names) - 1, 1)
+        render(background, animal, t, size, seed * 1000 + j).save(fname, quality=quality)
+    return len(file_names)
+
+
+def make_corpus(path, classes, n_seqs=1000, seasons=("S1", "S2", "S3", "S4"), size=IMAGE_SIZE, quality=QUALITY,
+                seed=0, workers=os.cpu_count()):
+    """
+    Writes a corpus of `n_seqs` sequences labeled with `classes` to `path` (one chunk per season, in the order
+    of `seasons`).
+    :return: train_metadata_with_labels as written
+    """
+    os.makedirs(path, exist_ok=True)
+    metadata, labels = sequences(classes, n_seqs, list(seasons), seed)
+    animal = labels['empty'] == 0
+    jobs = [(path, list(g.file_name), bool(animal[seq_id]), tuple(size), quality, seed + i)
+            for i, (seq_id, g) in enumerate(metadata.groupby("seq_id", sort=False))]
+    with mp.Pool(workers) as pool:
+        written = sum(pool.imap_unordered(_write_sequence, jobs, chunksize=8))
+    logging.info(f"wrote {written} images of {len(jobs)} sequences to {path}")
+
+    metadata.to_csv(os.path.join(path, "train_metadata.csv"), index=False)
+    labels.to_csv(os.path.join(path, "train_labels.csv"))
+    # same labels column as create_train_metadata_with_labels.py writes for the real data
+    with_labels = seqlabels.add_labels(metadata.copy(), seqlabels.sequence_labels(labels))
+    with_labels.to_csv(os.path.join(path, "train_metadata_with_labels.csv"), index=False)
+    season = labels.index.str.split("#").str[0].str[len("SER_"):]
+    chunk = pd.Series(season, index=labels.index).map({s: i + 1 for i, s in enumerate(seasons)})
+    chunk.rename("chunk").to_csv(os.path.join(path, "train_in_chunks_per_season.csv"), header=True)
+    return with_labels
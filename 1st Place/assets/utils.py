@@ -1,6 +1,6 @@
 import pandas as pd
 import numpy as np
-import os, random, math, glob
+import argparse, os, random, math, glob, time, inspect, collections
 from fastai.vision import *
 import fastai
 #from sklearn.metrics import log_loss as skll
@@ -8,6 +8,7 @@ from datetime import datetime
 import logging
 from assets.models import pretrainedmodels
 from assets.models import efficientnets
+from assets import imagescan
 
 # We get to see the log output for our execution, so log away!
 logging.basicConfig(level=logging.INFO)
@@ -27,18 +28,45 @@ def get_efficientnet(B="b1"):
 def get_srx50(pretrained=False,**kwargs):
     return pretrainedmodels.se_resnext50_32x4d(num_classes=1000,pretrained=None)
 
-def open_croped_image1(fn:PathOrStr, div:bool=True, convert_mode:str='RGB', cls:type=Image,
-        after_open:Callable=None)->Image:
-    "Return `Image` object created from image in file `fn`."
-    
+# (width, height) JPEGs are decoded at: libjpeg scales by 1/2, 1/4 or 1/8 in the DCT domain while decoding
+# and `Image.draft` picks the smallest of those scales that is still at least this size. None decodes at full size.
+DRAFT_SIZE = (512, 384)
+
+# Files known to be unreadable from a scan of scan_images.py, see `skip_bad_files`
+BAD_FILES = set()
+_placeholder = PIL.Image.new('RGB', (512, 384))
+
+def skip_bad_files(db:PathOrStr, path:PathOrStr):
+    "Serve the placeholder for the bad files recorded in the scan `db` (file names relative to `path`) without opening them."
+    global BAD_FILES
+    if not os.path.exists(db):
+        logging.info(f"No image scan at {db}, run scan_images.py to skip bad files.")
+        return
+    BAD_FILES = {os.path.normpath(os.path.join(str(path), f)) for f in imagescan.bad_files(db)}
+    logging.info(f"Skipping {len(BAD_FILES)} bad files recorded in {db}.")
+
+def open_pil_image(fn:PathOrStr, convert_mode:str='RGB', draft_size:Tuple[int,int]=None)->PIL.Image.Image:
+    "Return PIL image in file `fn`, JPEGs decoded at no less than `draft_size` (w,h) if given, or a black 512x384 one if the file can't be read."
+    if BAD_FILES and os.path.normpath(str(fn)) in BAD_FILES: return _placeholder.convert(convert_mode)
     with warnings.catch_warnings():
         warnings.simplefilter("ignore", UserWarning) # EXIF warning from TiffPlugin
         try:
             #print(fn)
-            x = PIL.Image.open(fn).convert(convert_mode)           
+            x = PIL.Image.open(fn)
+            if draft_size is not None: x.draft(convert_mode, draft_size)
+            x = x.convert(convert_mode)
         except:
             print("\t\t",fn,"corrupt")
-            x = PIL.Image.new('RGB', (512, 384)).convert(convert_mode)   
+            x = _placeholder.convert(convert_mode)
+    return x
+
+# default `draft_size` of the image openers: the value `DRAFT_SIZE` has when they are called
+_DRAFT_SIZE = object()
+
+def open_croped_image1(fn:PathOrStr, div:bool=True, convert_mode:str='RGB', cls:type=Image,
+        after_open:Callable=None, draft_size:Tuple[int,int]=_DRAFT_SIZE)->Image:
+    "Return `Image` object created from image in file `fn`, decoded at no less than `draft_size` (default `DRAFT_SIZE`)."
+    x = open_pil_image(fn, convert_mode, DRAFT_SIZE if draft_size is _DRAFT_SIZE else draft_size)
     if after_open: x = after_open(x)    
     x = pil2tensor(x,np.float32)
     if div: x.div_(255)
@@ -46,17 +74,10 @@ def open_croped_image1(fn:PathOrStr, div:bool=True, convert_mode:str='RGB', cls:
 vision.data.open_image = open_croped_image1
 
 def open_croped_image_flipped(fn:PathOrStr, div:bool=True, convert_mode:str='RGB', cls:type=Image,
-        after_open:Callable=None)->Image:
-    "Return `Image` object created from image in file `fn`."
-    
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore", UserWarning) # EXIF warning from TiffPlugin
-        try:
-            # print(fn)
-            x = PIL.Image.open(fn).convert(convert_mode).transpose(PIL.Image.FLIP_LEFT_RIGHT)          
-        except:
-            print("\t\t",fn,"corrupt")
-            x = PIL.Image.new('RGB', (512, 384)).convert(convert_mode)   
+        after_open:Callable=None, draft_size:Tuple[int,int]=_DRAFT_SIZE)->Image:
+    "Return `Image` object created from image in file `fn`, decoded at no less than `draft_size` (default `DRAFT_SIZE`)."
+    x = open_pil_image(fn, convert_mode, DRAFT_SIZE if draft_size is _DRAFT_SIZE else draft_size)
+    x = x.transpose(PIL.Image.FLIP_LEFT_RIGHT)
     if after_open: x = after_open(x)    
     x = pil2tensor(x,np.float32)
     if div: x.div_(255)
@@ -73,6 +94,25 @@ def seed_everything(seed):
 
 seed_everything(0)
 
+def draft_parity(fnames:Collection[PathOrStr], size:Tuple[int,int]=(384,512), draft_size:Tuple[int,int]=None,
+                 max_mean_diff:float=3.0)->dict:
+    "Decode time of `fnames` by `open_croped_image1` with and without draft decoding, and the pixel difference (0-255) it makes after fastai's validation transforms at `size` (h,w), as the models get them; asserts the mean absolute difference stays below `max_mean_diff`."
+    draft_size = ifnone(draft_size, DRAFT_SIZE)
+    diffs,times = [],{'full':0.,'draft':0.}
+    for fn in fnames:
+        imgs = {}
+        for k,d in [('full',None), ('draft',draft_size)]:
+            start = time.perf_counter()
+            img = open_croped_image1(fn, draft_size=d)
+            times[k] += time.perf_counter() - start
+            imgs[k] = img.apply_tfms(get_transforms()[1], size=size).data.mul(255).numpy()
+        diffs.append(np.abs(imgs['full'] - imgs['draft']))
+    res = {'images':len(diffs), 'draft_size':draft_size, 'mean_abs_diff':float(np.mean([d.mean() for d in diffs])),
+           'max_abs_diff':float(max(d.max() for d in diffs)), 'full_seconds':round(times['full'],3),
+           'draft_seconds':round(times['draft'],3), 'speedup':round(times['full']/times['draft'],2)}
+    assert res['mean_abs_diff'] < max_mean_diff, f"draft decoding differs by {res['mean_abs_diff']:.2f} on average"
+    return res
+
 
 # class AggLogLoss(Callback):
 #     "Wrap a `func` in a callback for metrics computation."
@@ -112,15 +152,66 @@ class Head(nn.Module):
         x = self.fc(self.dropout(x))
         return x
     
+# `torch._foreach_*` ops run one kernel per list of tensors instead of one Python call per parameter (torch>=1.7)
+_foreach = hasattr(torch, '_foreach_mul_')
+
 class AccumulateOptimWrapper(OptimWrapper):
+    "`OptimWrapper` that only steps on `real_step`, with the gradients of all parameters in flat buffers."
     def step(self):           pass
     def zero_grad(self):      pass
-    def real_step(self):      super().step()
-    def real_zero_grad(self): super().zero_grad()
-        
+
+    def real_step(self):
+        "Weight decay with one foreach op per layer group, then the optimizer step."
+        if not (self.true_wd and _foreach): return super().step()
+        with torch.no_grad():
+            for lr,wd,pg1,pg2 in zip(self._lr,self._wd,self.opt.param_groups[::2],self.opt.param_groups[1::2]):
+                ps = pg1['params'] + (pg2['params'] if self.bn_wd else [])
+                if ps: torch._foreach_mul_(ps, 1 - wd*lr)
+        self.set_val('weight_decay', listify(0, self._wd))
+        self.opt.step()
+
+    def real_zero_grad(self):
+        if getattr(self, 'grad_buffers', None) is None: return super().zero_grad()
+        for buf in self.grad_buffers: buf.zero_()
+
+    def flatten_grads(self):
+        "Make the gradients of all trainable parameters views into one contiguous buffer per device and dtype."
+        params = [p for pg in self.opt.param_groups for p in pg['params'] if p.requires_grad]
+        if [id(p) for p in params] == getattr(self, 'flat_params', None): return
+        groups = collections.OrderedDict()
+        for p in params: groups.setdefault((p.device, p.dtype), []).append(p)
+        self.grad_buffers = []
+        for (device,dtype),ps in groups.items():
+            buf = torch.zeros(sum(p.numel() for p in ps), device=device, dtype=dtype)
+            offset = 0
+            for p in ps:
+                g = buf[offset:offset+p.numel()].view_as(p)
+                if p.grad is not None: g.copy_(p.grad)
+                p.grad = g
+                offset += p.numel()
+            self.grad_buffers.append(buf)
+        self.flat_params = [id(p) for p in params]
+
+    def scale_grads(self, div:float):
+        "Divide all gradients by `div`, one op per flat buffer."
+        if getattr(self, 'grad_buffers', None) is None:
+            grads = [p.grad for pg in self.opt.param_groups for p in pg['params'] if p.requires_grad and p.grad is not None]
+            if _foreach: torch._foreach_div_(grads, div)
+            else:
+                for g in grads: g.div_(div)
+        else:
+            for buf in self.grad_buffers: buf.div_(div)
+
+def _with_foreach(opt_func:Callable)->Callable:
+    "`opt_func` with `foreach=True` if its optimizer accepts it (torch>=1.12)."
+    func = opt_func.func if isinstance(opt_func, partial) else opt_func
+    try: accepts = 'foreach' in inspect.signature(func).parameters
+    except (TypeError, ValueError): accepts = False
+    return partial(opt_func, foreach=True) if accepts else opt_func
+
 def acc_create_opt(self, lr:Floats, wd:Floats=0.):
         "Create optimizer with `lr` learning rate and `wd` weight decay."
-        self.opt = AccumulateOptimWrapper.create(self.opt_func, lr, self.layer_groups,
+        self.opt = AccumulateOptimWrapper.create(_with_foreach(self.opt_func), lr, self.layer_groups,
                                          wd=wd, true_wd=self.true_wd, bn_wd=self.bn_wd)
 Learner.create_opt = acc_create_opt   
 
@@ -133,6 +224,10 @@ class AccumulateStep(LearnerCallback):
         super().__init__(learn)
         self.n_step = n_step
 
+    def on_train_begin(self, **kwargs):
+        "accumulate into flat gradient buffers"
+        self.learn.opt.flatten_grads()
+
     def on_epoch_begin(self, **kwargs):
         "init samples and batches, change optimizer"
         self.acc_batches = 0
@@ -144,9 +239,7 @@ class AccumulateStep(LearnerCallback):
     def on_backward_end(self, **kwargs):
         "step if number of desired batches accumulated, reset samples"
         if (self.acc_batches % self.n_step) == self.n_step - 1:
-            for p in (self.learn.model.parameters()):
-                if p.requires_grad: p.grad.div_(self.acc_batches)
-    
+            self.learn.opt.scale_grads(self.acc_batches)
             self.learn.opt.real_step()
             self.learn.opt.real_zero_grad()
             self.acc_batches = 0
@@ -154,9 +247,118 @@ class AccumulateStep(LearnerCallback):
     def on_epoch_end(self, **kwargs):
         "step the rest of the accumulated grads"
         if self.acc_batches > 0:
-            for p in (self.learn.model.parameters()):
-                if p.requires_grad: p.grad.div_(self.acc_batches)
+            self.learn.opt.scale_grads(self.acc_batches)
             self.learn.opt.real_step()
             self.learn.opt.real_zero_grad()
             self.acc_batches = 0
-            
+
+def _accumulated_steps(opt:OptimWrapper, params:Collection[Tensor], n_step:int, iters:int, flat:bool)->List[float]:
+    "Seconds of `iters` accumulated steps of `opt` after one warm-up step, as `AccumulateStep` ran them before (`flat=False`) and runs them now."
+    times = []
+    for i in range(iters+1):
+        start = time.perf_counter()
+        if flat:
+            opt.scale_grads(n_step)
+            opt.real_step()
+            opt.real_zero_grad()
+        else:
+            for p in params: p.grad.div_(n_step)
+            opt.step()
+            opt.zero_grad()
+        if i > 0: times.append(time.perf_counter() - start)  # the first step allocates the Adam state
+        # stands in for the backward pass, which allocates the gradients torch's zero_grad may have set to None
+        for p in params:
+            if p.grad is None: p.grad = torch.zeros_like(p)
+    return times
+
+def benchmark_accumulate_step(model:nn.Module=None, n_step:int=4, iters:int=10, wd:float=1e-2, lr:float=1e-4)->dict:
+    "Seconds per accumulated optimizer step (gradient scaling, true weight decay, Adam, zeroing) of `model` (default SE-ResNeXt50) with fastai's `OptimWrapper` and per-parameter scaling, and with `AccumulateOptimWrapper` on flat gradient buffers; asserts both end with the same weights and Adam state."
+    model = ifnone(model, get_srx50())
+    opt_func = partial(optim.Adam, betas=(0.9,0.99))
+    res,weights = {},{}
+    for name,wrapper in [('per_param',OptimWrapper), ('flat_foreach',AccumulateOptimWrapper)]:
+        m = deepcopy(model)
+        params = [p for p in m.parameters() if p.requires_grad]
+        torch.manual_seed(0)
+        for p in params: p.grad = torch.randn_like(p)
+        flat = wrapper is AccumulateOptimWrapper
+        opt = wrapper.create(_with_foreach(opt_func) if flat else opt_func, lr, [nn.Sequential(*flatten_model(m))],
+                             wd=wd, true_wd=True, bn_wd=False)
+        if flat: opt.flatten_grads()
+        res[name] = round(float(np.median(_accumulated_steps(opt, params, n_step, iters, flat))), 4)
+        # Adam's update hardly depends on the scale of the gradients, its first moment does
+        weights[name] = torch.cat([t.detach().flatten() for p in params for t in (p, opt.opt.state[p]['exp_avg'])])
+    diff = (weights['per_param'] - weights['flat_foreach']).abs().max().item()
+    assert diff < 1e-5, f'AccumulateOptimWrapper differs from OptimWrapper by up to {diff} after {iters+1} steps'
+    res.update({'max_abs_diff':diff, 'speedup':round(res['per_param'] / res['flat_foreach'], 2)})
+    return res
+
+class BF16Autocast(LearnerCallback):
+    """
+    Runs the forward pass under bfloat16 CPU autocast, the loss and the backward pass in fp32.
+    Weights, gradients and optimizer state stay fp32, so `AccumulateStep` accumulates as before.
+    bfloat16 has the exponent range of fp32, so unlike fp16 gradients do not underflow and need no loss scaling.
+    """
+    def on_train_begin(self, **kwargs):
+        self.autocast = None
+
+    def on_batch_begin(self, **kwargs):
+        "enter autocast for the forward pass"
+        self._exit()
+        self.autocast = torch.autocast('cpu', dtype=torch.bfloat16)
+        self.autocast.__enter__()
+
+    def on_loss_begin(self, last_output, **kwargs):
+        "leave autocast and compute the loss on fp32 outputs"
+        self._exit()
+        return {'last_output': last_output.float()}
+
+    def on_batch_end(self, **kwargs): self._exit()
+    def on_train_end(self, **kwargs): self._exit()
+
+    def _exit(self):
+        if self.autocast is not None:
+            self.autocast.__exit__(None, None, None)
+            self.autocast = None
+
+def training_args():
+    "Command line flags of the training scripts."
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bf16', action='store_true', help='train under bfloat16 CPU autocast, see `BF16Autocast`')
+    return parser.parse_args()
+
+def _training_steps(arch:str, bf16:bool, bs:int, size:Tuple[int,int], steps:int)->dict:
+    "Images/s and peak RSS of `steps` training steps of `arch` on random batches, run in a fresh process by `benchmark_bf16`."
+    import resource
+    torch.manual_seed(0)
+    if arch == 'srx50': model = get_srx50()
+    else:
+        model = efficientnets.EfficientNet.from_name('efficientnet-'+arch)
+        model.add_module('_fc', nn.Linear(model._fc.in_features, 54))
+    opt = optim.Adam(model.parameters(), lr=1e-4)
+    x = torch.randn(bs, 3, *size)
+    model.train()
+    times = []
+    for i in range(steps+1):
+        start = time.perf_counter()
+        with torch.autocast('cpu', dtype=torch.bfloat16, enabled=bf16):
+            out = model(x)
+        y = (torch.rand(out.shape) < 0.05).float()
+        loss = F.binary_cross_entropy_with_logits(out.float(), y)
+        loss.backward()
+        opt.step()
+        opt.zero_grad()
+        if i > 0: times.append(time.perf_counter() - start)  # the first step allocates the Adam state
+    return {'arch': arch, 'bf16': bf16, 'bs': bs, 'images_per_sec': round(bs / float(np.median(times)), 2),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024), 'loss': round(loss.item(), 4)}
+
+def benchmark_bf16(arch:str='b3', bs:int=11, size:Tuple[int,int]=(384,512), steps:int=5)->pd.DataFrame:
+    "Training throughput and peak RSS of `arch` ('b1', 'b3' or 'srx50') in fp32 and under bfloat16 autocast."
+    # peak RSS is per process, so every mode runs in a process of its own
+    ctx = torch.multiprocessing.get_context('spawn')
+    res = []
+    for bf16 in [False, True]:
+        with ctx.Pool(1) as pool: res.append(pool.apply(_training_steps, (arch, bf16, bs, size, steps)))
+        logging.info(f"{arch} {'bf16' if bf16 else 'fp32'}: {res[-1]['images_per_sec']} images/s, "
+                     f"peak RSS {res[-1]['peak_rss_mb']} MB")
+    return pd.DataFrame(res)
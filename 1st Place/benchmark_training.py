@@ -0,0 +1,133 @@
+import argparse
+import json
+from assets.utils import *
+from assets import manifest, synthetic
+from assets.models import registry
+
+# model and loader configuration of every training script: architecture, batch size, batches accumulated
+# per step (of the first chunk for the seasonal scripts) and whether the data comes from the chunk manifests
+CONFIGS = {
+    "random_eff3": dict(arch="b3", bs=11, n_step=3, chunked=False),
+    "random_srx50": dict(arch="srx50", bs=13, n_step=3, chunked=False),
+    "seasonal-chunks_eff1": dict(arch="b1", bs=16, n_step=2, chunked=True),
+    "seasonal-chunks_srx50": dict(arch="srx50", bs=16, n_step=2, chunked=True),
+}
+SZ = (384, 512)
+
+
+def make_data(path, cfg, num_workers):
+    "The databunch of the training script of `cfg`, on the first chunk for the seasonal ones."
+    if cfg["chunked"]:
+        src = (manifest.ManifestImageList.from_manifest(manifest.chunk_manifest(path+"manifests/", 1), path)
+               .split_none()
+               .label_from_manifest())
+    else:
+        train_metadata = pd.read_csv(path+"train_metadata_with_labels.csv")
+        # all 54 classes, as in the real labels, even if the synthetic corpus misses some
+        src = (ImageList.from_df(path=path, df=train_metadata, cols="file_name")
+               .split_none()
+               .label_from_df(cols='labels', label_delim=';', classes=registry.CLASSES))
+    return (src.transform(get_transforms(max_rotate=5,max_warp=0, max_zoom=1.02,
+                                         p_affine=.0 , p_lighting=.0,), size=SZ)
+            .databunch(bs=cfg["bs"], num_workers=num_workers)
+            .normalize(imagenet_stats))
+
+
+def make_learner(data, cfg):
+    "The learner of the training script of `cfg`, without downloading pretrained weights."
+    if cfg["arch"] == "srx50":
+        return cnn_learner(data, base_arch=get_srx50, cut=-2, custom_head=Head(512*4, data.c, 0.0),
+                           bn_wd=False, true_wd=True)
+    return Learner(data, registry.efficientnet(cfg["arch"]), wd=1e-2, bn_wd=False, true_wd=True)
+
+
+def item_throughput(ds, n):
+    "Images/s of decoding and of decoding plus the training transforms of `n` random items of `ds`."
+    idx = np.random.RandomState(0).choice(len(ds), min(n, len(ds)), replace=False)
+    start = time.perf_counter()
+    for i in idx: ds.x.get(i)
+    decode = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in idx: ds[i]
+    item = time.perf_counter() - start
+    return {"decode_images_per_sec": round(len(idx) / decode, 2),
+            "augment_ms_per_image": round(1000 * max(item - decode, 0) / len(idx), 2),
+            "item_images_per_sec": round(len(idx) / item, 2)}
+
+
+class StepTimer(LearnerCallback):
+    "Times `n` training batches after `skip` warm-up ones, split into waiting for the loader and the step, then stops training."
+    def __init__(self, learn:Learner, n:int, skip:int=2):
+        super().__init__(learn)
+        self.n,self.skip = n,skip
+
+    def on_train_begin(self, **kwargs):
+        self.batches,self.images,self.wait,self.step = 0,0,0.,0.
+        self.last = time.perf_counter()
+
+    def on_batch_begin(self, last_input, **kwargs):
+        self.start = time.perf_counter()
+        if self.batches >= self.skip:
+            self.wait += self.start - self.last
+            self.images += last_input.shape[0]
+
+    def on_batch_end(self, **kwargs):
+        self.last = time.perf_counter()
+        if self.batches >= self.skip: self.step += self.last - self.start
+        self.batches += 1
+        if self.batches >= self.n + self.skip: return {'stop_epoch': True, 'stop_training': True}
+
+    def report(self)->dict:
+        assert self.images, f'no batches left after the {self.skip} warm-up ones, generate a larger corpus'
+        return {"steps": self.batches - self.skip,
+                "step_images_per_sec": round(self.images / self.step, 2),
+                "loader_wait_fraction": round(self.wait / (self.wait + self.step), 3),
+                "images_per_sec": round(self.images / (self.wait + self.step), 2)}
+
+
+def benchmark(path, name, steps, items, num_workers, bf16=False):
+    "Decode, augmentation and training step throughput of the training script configuration `name`."
+    cfg = CONFIGS[name]
+    data = make_data(path, cfg, num_workers)
+    res = {"config": name, "bf16": bf16, **cfg, **item_throughput(data.train_ds, items)}
+    learn = make_learner(data, cfg)
+    if bf16: learn.callback_fns.append(BF16Autocast)
+    learn.unfreeze()
+    timer = StepTimer(learn, steps)
+    learn.fit(1, 1e-4, callbacks=[AccumulateStep(learn, cfg["n_step"]), timer])
+    res.update(timer.report())
+    logging.info(f"{name}: {res['decode_images_per_sec']} decodes/s, {res['augment_ms_per_image']} ms augmentation, "
+                 f"{res['step_images_per_sec']} images/s in steps, {res['images_per_sec']} images/s end to end")
+    return res
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Training throughput of the training scripts on a synthetic corpus")
+    parser.add_argument("--data", default="/tmp/hakuna_synthetic/",
+                        help="directory of the synthetic corpus, generated there if it does not exist yet")
+    parser.add_argument("--n-seqs", type=int, default=500, help="sequences of a newly generated corpus")
+    parser.add_argument("--image-size", type=int, nargs=2, default=synthetic.IMAGE_SIZE, metavar=("W", "H"),
+                        help="size of the JPEGs of a newly generated corpus")
+    parser.add_argument("--configs", nargs="+", choices=list(CONFIGS), default=list(CONFIGS))
+    parser.add_argument("--steps", type=int, default=10, help="timed training batches per configuration")
+    parser.add_argument("--items", type=int, default=50, help="images timed for decoding and augmentation")
+    parser.add_argument("--num-workers", type=int, default=defaults.cpus, help="data loader processes")
+    parser.add_argument("--bf16", action="store_true", help="train under bfloat16 CPU autocast")
+    parser.add_argument("--output", default=None, help="write the JSON report there instead of stdout")
+    args = parser.parse_args()
+
+    path = os.path.join(args.data, "")
+    if not os.path.exists(path+"train_metadata_with_labels.csv"):
+        synthetic.make_corpus(path, registry.CLASSES, args.n_seqs, size=tuple(args.image_size))
+        manifest.build_chunk_manifests(pd.read_csv(path+"train_metadata.csv"),
+                                       pd.read_csv(path+"train_labels.csv", index_col="seq_id"),
+                                       pd.read_csv(path+"train_in_chunks_per_season.csv", index_col="seq_id")["chunk"],
+                                       path+"manifests/")
+    n_images = len(pd.read_csv(path+"train_metadata.csv", usecols=["file_name"]))
+    report = {"data": path, "images": n_images, "torch": torch.__version__, "threads": torch.get_num_threads(),
+              "results": [benchmark(path, name, args.steps, args.items, args.num_workers, args.bf16)
+                          for name in args.configs]}
+    text = json.dumps(report, indent=2)
+    if args.output is None: print(text)
+    else:
+        with open(args.output, "w") as f: f.write(text)
@@ -0,0 +1,24 @@
+from fastai.vision import *
+import argparse
+import json
+from assets.models import registry
+from assets import utils
+from config import config
+
+path = config.DATA_PATH
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that JPEG draft decoding (config.DRAFT_SIZE) leaves the "
+                                                 "images the models get unchanged, see assets/utils.py")
+    parser.add_argument("--metadata", default="test_metadata.csv",
+                        help="metadata csv in the data directory whose images are sampled")
+    parser.add_argument("--n-images", type=int, default=200, help="random images compared")
+    parser.add_argument("--max-mean-diff", type=float, default=3.0,
+                        help="largest mean absolute pixel difference (0-255) that passes")
+    args = parser.parse_args()
+
+    frames = pd.read_csv(path+args.metadata, usecols=["file_name"])
+    frames = frames.sample(min(args.n_images, len(frames)), random_state=0)
+    res = utils.draft_parity([path+f for f in frames.file_name], registry.INPUT_SIZE, config.DRAFT_SIZE,
+                             args.max_mean_diff)
+    print(json.dumps(res, indent=2))
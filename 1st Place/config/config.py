@@ -1 +1,49 @@
 DATA_PATH = "/mnt/data/Projects/Hakuna-Ma-data/"
+
+# (width, height) JPEGs are decoded at by libjpeg's DCT-domain downscaling before the final resize,
+# see `assets.utils.DRAFT_SIZE`; None decodes at full resolution
+DRAFT_SIZE = (512, 384)
+
+# Results of scan_images.py; the images it found unreadable are replaced by a placeholder without being opened
+IMAGE_SCAN = DATA_PATH + "image_scan.sqlite"
+
+# Per-chunk training manifests written by create_chunk_manifests.py
+MANIFEST_DIR = DATA_PATH + "manifests/"
+
+# Chunked training: bytes of the next chunk's images read ahead while the current chunk trains (None for all of
+# them), and a directory on fast local storage to copy them to instead of only warming the page cache
+PREFETCH_BYTES = 200 * 2**30
+PREFETCH_STAGING_DIR = None
+
+# Ensemble members of predict.py as (output name, registered model), see `assets.models.registry`
+ENSEMBLE = [("p4", "model_b3"), ("p5", "model_b1_season10"),
+            ("p1", "best-sat-0075"), ("p2", "best-thu"), ("p3", "model_srx50")]
+
+# Test-time augmentation: extra views each ensemble member is scored on, as {member: {view: output name}}.
+# Views are computed in memory from the decoded batch, see `assets.inference.TTA_VIEWS`.
+TTA_POLICY = {"p3": {"hflip": "p3a"}}
+
+# Blend weights of the member and TTA outputs, summed in this order
+BLEND_WEIGHTS = [("p1", .05), ("p2", .05), ("p3", .4), ("p3a", .4), ("p4", .05), ("p5", .05)]
+
+# Number of sequences scored and written per chunk by predict.py, None scores the whole test set at once.
+# Chunks are the unit a crashed run resumes from (see `assets.journal`), so None also recomputes everything.
+STREAM_CHUNK_SIZE = 10000
+
+# Frames scored per sequence by predict.py, the ones differing most from the sequence's background
+# (see `assets.keyframes`), at least 1; None scores every frame
+FRAME_BUDGET = None
+
+# Cascade of predict.py --cascade: the cheap `gate` member scores every image first and only images (level
+# "frame") or whole sequences (level "seq") it is unsure about go through the rest of the ensemble. Unsure means
+# an empty probability inside `empty_band` or a margin between the two most likely classes below `min_margin`.
+CASCADE = {"gate": "p5", "level": "seq", "empty_band": (0.02, 0.98), "min_margin": 0.6}
+
+# Weight-averaged SE-ResNeXt50 written by make_soup.py: registered model, the checkpoints it averages with their
+# coefficients, and the number of training images its BatchNorm statistics are recomputed on
+SOUP = {"name": "soup_srx50", "models": [("best-sat-0075", 1.), ("best-thu", 1.), ("model_srx50", 1.)],
+        "calib_images": 1024}
+
+# Ensemble and blend weights of predict.py --soup: the soup takes the place of p1, p2 and p3 (and their weight)
+SOUP_ENSEMBLE = [("p4", "model_b3"), ("p5", "model_b1_season10"), ("p3", "soup_srx50")]
+SOUP_BLEND_WEIGHTS = [("p3", .45), ("p3a", .45), ("p4", .05), ("p5", .05)]
@@ -0,0 +1,13 @@
+import pandas as pd
+from assets import manifest
+from config import config
+
+path = config.DATA_PATH
+
+# one manifest per training chunk: image files and their multi-hot labels, see assets/manifest.py
+train_metadata = pd.read_csv(path+"train_metadata.csv", usecols=["seq_id", "file_name"])
+train_labels = pd.read_csv(path+"train_labels.csv", index_col="seq_id")
+chunks = pd.read_csv(path+"train_in_chunks_per_season.csv", index_col="seq_id")
+
+for fname in manifest.build_chunk_manifests(train_metadata, train_labels, chunks["chunk"], config.MANIFEST_DIR):
+    print(fname)
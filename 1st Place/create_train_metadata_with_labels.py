@@ -1,13 +1,51 @@
+import argparse
+import multiprocessing as mp
 import pandas as pd
+from assets import seqlabels
 from config import config
 
 path = config.DATA_PATH
 
-train_metadata = pd.read_csv(path+"train_metadata.csv")
-train_labels = pd.read_csv(path+"train_labels.csv", index_col="seq_id")
 
-l = lambda x: ";".join(list(train_labels.loc[x].loc[train_labels.loc[x] > 0].index))
-train_metadata['labels'] = train_metadata.seq_id.map(l)
+# labels of the chunked mode's worker processes
+_labels = None
 
-train_metadata.to_csv(path+"train_metadata_with_labels.csv",index=False)
-train_metadata.head(3)
\ No newline at end of file
+
+def _init_worker(labels):
+    global _labels
+    _labels = labels
+
+
+def _chunk_csv(args):
+    chunk, header = args
+    return seqlabels.add_labels(chunk, _labels).to_csv(index=False, header=header)
+
+
+def create_chunked(labels, chunksize, workers):
+    """Same output, for metadata that does not fit in memory: `chunksize` rows at a time, joined in `workers` processes. """
+    reader = pd.read_csv(path+"train_metadata.csv", chunksize=chunksize)
+    jobs = ((chunk, i == 0) for i, chunk in enumerate(reader))
+    with mp.Pool(workers, initializer=_init_worker, initargs=(labels,)) as pool, \
+            open(path+"train_metadata_with_labels.csv", "w", newline="") as f:
+        # imap keeps the chunks in file order
+        for text in pool.imap(_chunk_csv, jobs):
+            f.write(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="process train_metadata.csv this many rows at a time (default: all at once)")
+    parser.add_argument("--workers", type=int, default=mp.cpu_count(), help="processes of the chunked mode")
+    args = parser.parse_args()
+
+    train_labels = pd.read_csv(path+"train_labels.csv", index_col="seq_id")
+    labels = seqlabels.sequence_labels(train_labels)
+
+    if args.chunksize is None:
+        train_metadata = pd.read_csv(path+"train_metadata.csv")
+        train_metadata = seqlabels.add_labels(train_metadata, labels)
+        train_metadata.to_csv(path+"train_metadata_with_labels.csv",index=False)
+        print(train_metadata.head(3))
+    else:
+        create_chunked(labels, args.chunksize, args.workers)
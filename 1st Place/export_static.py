@@ -0,0 +1,28 @@
+import argparse
+import json
+import logging
+import torch
+from assets.models import deploy
+from assets.models import registry
+
+logging.basicConfig(level=logging.INFO)
+
+MODEL_DIR = "assets/models"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the registered models to frozen TorchScript at their input size")
+    parser.add_argument("--models", nargs="+", default=["model_b3", "model_b1_season10"], choices=list(registry.REGISTRY),
+                        help="registered models to compile, written next to their weights as <name>.ts")
+    parser.add_argument("--batch-size", type=int, default=32, help="batch size the models are traced with")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="only report the latency per batch of the dynamic, trained, static and compiled EfficientNets")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads of the benchmark")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        if args.threads: torch.set_num_threads(args.threads)
+        print(json.dumps([r for B in ["b1", "b3"] for r in deploy.benchmark(B, args.batch_size)], indent=2))
+    else:
+        for name in args.models:
+            logging.info(f"{name} compiled to {deploy.export(name, MODEL_DIR, args.batch_size)}")
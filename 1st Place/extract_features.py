@@ -0,0 +1,130 @@
+from fastai.vision import *
+import argparse
+import logging
+from torchvision.models import resnext50_32x4d, resnext101_32x8d
+from assets.models import embed
+from assets.models import registry
+from assets import embeddings
+from assets import inference
+from assets import journal
+from assets import utils
+from config import config
+
+path = config.DATA_PATH
+logging.basicConfig(level=logging.INFO)
+
+utils.DRAFT_SIZE = config.DRAFT_SIZE
+utils.skip_bad_files(config.IMAGE_SCAN, path)
+
+MODEL_DIR = "assets/models"
+
+# 2nd Place backbones, loaded from their submit/assets checkpoints with --checkpoint
+RESNEXTS = {"resnext50_32x4d": resnext50_32x4d, "resnext101_32x8d": resnext101_32x8d}
+# long side the frames are resized to for them after squashing to 512x384, like in the 2nd Place submit/main.py
+RESNEXT_LONG_SIDE = {"resnext50_32x4d": None, "resnext101_32x8d": 360}
+
+METADATA = {"train": "train_metadata.csv", "test": "test_metadata.csv"}
+
+
+def resnext_state_dict(checkpoint):
+    """Weights of a 2nd Place ResNeXt `checkpoint`, also of a training checkpoint with the thunder_hammer names
+    under "state_dict", renamed like `get_model` of the 2nd Place submit/main.py does. """
+    state = torch.load(checkpoint, map_location="cpu")
+    if "state_dict" not in state: return state
+    return {k.replace("model.", "").replace("last_linear.", "fc."): v for k, v in state["state_dict"].items()}
+
+
+class ResNeXtImageDataset(torch.utils.data.Dataset):
+    """Images in `fnames` as float CHW tensors of 0-255 pixel values, resized like `HakunaInferDataset.get_image`
+    of the 2nd Place submit/main.py: squashed to 512x384 and then, with a `long_side`, to that long side
+    rounded down to multiples of 16. """
+    def __init__(self, fnames, long_side=None):
+        self.fnames, self.long_side = list(fnames), long_side
+
+    def __len__(self): return len(self.fnames)
+
+    def __getitem__(self, i):
+        # LANCZOS is main.py's ANTIALIAS, which newer Pillows dropped
+        img = PIL.Image.open(self.fnames[i]).resize((512, 384), PIL.Image.LANCZOS)
+        if self.long_side is not None:
+            w, h = img.size
+            ratio = max(h / self.long_side, w / self.long_side)
+            img = img.resize((int((w / ratio) // 16 * 16), int((h / ratio) // 16 * 16)), resample=PIL.Image.LANCZOS)
+        return torch.from_numpy(np.array(img)).permute(2, 0, 1).float()
+
+
+def resnext_input_size(model):
+    """(h, w) of the frames `ResNeXtImageDataset` feeds the 2nd Place ResNeXt `model`. """
+    long_side = RESNEXT_LONG_SIDE[model]
+    if long_side is None: return (384, 512)
+    ratio = 512 / long_side
+    return (int((384 / ratio) // 16 * 16), int((512 / ratio) // 16 * 16))
+
+
+def load_backbone(model, checkpoint=None):
+    """The registered `model`, or the 2nd Place ResNeXt `model` with the weights of `checkpoint`,
+    and its weight file. """
+    if model in RESNEXTS:
+        net = RESNEXTS[model](num_classes=len(registry.CLASSES))
+        net.load_state_dict(resnext_state_dict(checkpoint))
+        return net.to(defaults.device).eval(), checkpoint
+    return registry.load_model(model, MODEL_DIR, defaults.device), registry.weights_path(model, MODEL_DIR)
+
+
+def load_frames(split, seasons=None):
+    """Frames of the `split` ("train" or "test"), sorted by file name, optionally only of the `seasons`. """
+    frames = pd.read_csv(path+METADATA[split]).sort_values("file_name")
+    if seasons:
+        frames = frames[frames.seq_id.str.extract(r"^SER_(S\d+)#", expand=False).isin(seasons)]
+    return frames
+
+
+def frames_dl(frames, model, bs=32, num_workers=defaults.cpus):
+    """Normalized batches of `frames` preprocessed for `model`: like the 1st Place models were trained on, or for
+    a 2nd Place ResNeXt like its submit/main.py does. """
+    if model not in RESNEXTS:
+        return inference.image_dl(frames, path, size=registry.INPUT_SIZE, bs=bs, num_workers=num_workers)
+    ds = ResNeXtImageDataset([os.path.join(path, f) for f in frames.file_name], RESNEXT_LONG_SIDE[model])
+    dl = DataLoader(ds, batch_size=bs, shuffle=False, num_workers=num_workers,
+                    pin_memory=defaults.device.type == "cuda")
+    return inference.NormalizedBatches(dl)
+
+
+def extract_features(model, store, bs=32, num_workers=defaults.cpus):
+    """Writes the pooled embeddings of `model` for the frames of `store` that are not written yet. """
+    frames = store.index.iloc[store.written:]
+    if not len(frames): return store
+    logging.info(f"{store.path}: {store.written} of {len(store)} frames done, extracting {len(frames)}.")
+    dl = frames_dl(frames, store.meta["model"], bs, num_workers)
+    with inference.inference_mode():
+        for xb, _ in progress_bar(dl):
+            store.append(embed.features(model, xb).float().cpu().numpy())
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the pooled backbone embeddings of every frame to a store")
+    parser.add_argument("--model", default="model_b3", choices=list(registry.REGISTRY) + list(RESNEXTS),
+                        help="registered model, or 2nd Place ResNeXt loaded from --checkpoint")
+    parser.add_argument("--checkpoint", default=None, help="weights of a 2nd Place ResNeXt --model")
+    parser.add_argument("--split", default="train", choices=list(METADATA))
+    parser.add_argument("--seasons", nargs="+", default=None, help="only the frames of these seasons")
+    parser.add_argument("--output", default=None,
+                        help="directory of the store (default: <DATA_PATH>/embeddings/<model>_<split>)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--num-workers", type=int, default=defaults.cpus)
+    args = parser.parse_args()
+    assert (args.model in RESNEXTS) == (args.checkpoint is not None), "--checkpoint goes with a 2nd Place ResNeXt"
+
+    model, weights = load_backbone(args.model, args.checkpoint)
+    if args.model in RESNEXTS:
+        input_size, draft_size = resnext_input_size(args.model), None
+    else:
+        input_size, draft_size = registry.INPUT_SIZE, config.DRAFT_SIZE
+    output = ifnone(args.output, os.path.join(path, "embeddings", f"{args.model}_{args.split}"))
+    # a store of the same frames from the same weights resumes where it stopped
+    store = embeddings.EmbeddingStore.create(output, load_frames(args.split, args.seasons), embed.embedding_dim(model),
+                                             model=args.model, weights=journal.file_checksum(weights),
+                                             input_size=input_size, draft_size=draft_size)
+    extract_features(model, store, args.batch_size, args.num_workers)
+    logging.info(f"{len(store)} embeddings of {store.dim} dimensions in {output}.")
@@ -0,0 +1,94 @@
+from fastai.vision import *
+import argparse
+import json
+import logging
+from assets.models import registry
+from assets import inference
+from assets import seqagg
+from assets import soup
+from config import config
+
+path = config.DATA_PATH
+logging.basicConfig(level=logging.INFO)
+
+MODEL_DIR = "assets/models"
+
+
+def season_frames(train_metadata, season):
+    return train_metadata.seq_id.str.startswith(f"SER_{season}#")
+
+
+def calibration_dl(train_metadata, n_images, season=None, num_workers=defaults.cpus):
+    """Random sample of `n_images` training images to recompute BatchNorm statistics on, outside of `season`. """
+    frames = train_metadata if season is None else train_metadata[~season_frames(train_metadata, season)]
+    frames = frames.sample(min(n_images, len(frames)), random_state=0)
+    return inference.image_dl(frames, path, size=registry.INPUT_SIZE, bs=32, num_workers=num_workers)
+
+
+def build_soup(models, coefs=None, calib_images=1024, season=None, num_workers=defaults.cpus):
+    """Weight average of the registered `models` with its BatchNorm statistics recomputed. """
+    logging.info(f"Averaging {', '.join(models)}.")
+    model = soup.make_soup(models, coefs, MODEL_DIR)
+    train_metadata = pd.read_csv(path+"train_metadata.csv")
+    logging.info(f"Recomputing BatchNorm statistics on {calib_images} images.")
+    return soup.recalibrate_bn(model, calibration_dl(train_metadata, calib_images, season, num_workers),
+                               defaults.device)
+
+
+def report(model, models, season, coefs=None, n_seqs=None, num_workers=defaults.cpus):
+    """Log loss of the soup `model`, of every one of `models` and of their output average (weighted
+    by `coefs`) on the sequences of the labeled training `season` (optionally only the first `n_seqs`).
+    Every season is in the training data of the ensemble, so the log losses are in-sample and optimistic. """
+    train_metadata = pd.read_csv(path+"train_metadata.csv")
+    frames = train_metadata[season_frames(train_metadata, season)]
+    if n_seqs is not None:
+        frames = frames[frames.seq_id.isin(frames.seq_id.unique()[:n_seqs])]
+    agg = seqagg.SeqAggregator(frames.seq_id.values)
+    train_labels = pd.read_csv(path+"train_labels.csv", index_col="seq_id")
+    y_true = train_labels.loc[agg.seq_ids, registry.CLASSES].values
+
+    members = [inference.EnsembleMember(m, registry.load_model(m, MODEL_DIR, defaults.device)) for m in models]
+    members.append(inference.EnsembleMember("soup", model))
+    dl = inference.image_dl(frames, path, size=registry.INPUT_SIZE, bs=32, num_workers=num_workers)
+    preds = inference.ensemble_preds(members, dl)
+    coefs = [1.0] * len(models) if coefs is None else coefs
+    preds["ensemble"] = inference.blend(preds, [(m, c / sum(coefs)) for m, c in zip(models, coefs)])
+
+    results = {"season": season, "sequences": len(agg), "images": len(frames)}
+    for name, p in preds.items():
+        # same sequence aggregation as predict.py
+        seq_preds = agg.combine(p.numpy(), how="mean", per_class={14: "gmean"})  # f15
+        results[f"log_loss_{name}"] = round(inference.log_loss(y_true, seq_preds), 5)
+    results["log_loss_delta"] = round(results["log_loss_soup"] - results["log_loss_ensemble"], 5)
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    models, coefs = zip(*config.SOUP["models"])
+    parser = argparse.ArgumentParser(description="Average same-architecture checkpoints into one model")
+    parser.add_argument("--models", nargs="+", default=list(models), choices=list(registry.REGISTRY),
+                        help="registered models to average")
+    parser.add_argument("--coefs", nargs="+", type=float, default=None,
+                        help="coefficient of every model (default: config.SOUP's, or uniform with --models)")
+    parser.add_argument("--name", default=config.SOUP["name"], choices=list(registry.REGISTRY),
+                        help="registered model the soup is saved as, register a new one in assets/models/registry.py; "
+                             "predict.py --soup loads config.SOUP_ENSEMBLE's")
+    parser.add_argument("--calib-images", type=int, default=config.SOUP["calib_images"],
+                        help="training images to recompute the BatchNorm statistics on")
+    parser.add_argument("--season", default=None,
+                        help="labeled season the report is computed on, left out of the calibration sample; every "
+                             "season is in the training data of the ensemble, so its log losses are in-sample and "
+                             "optimistic")
+    parser.add_argument("--no-report", action="store_true", help="only write the soup weights")
+    args = parser.parse_args()
+    assert args.season or args.no_report, "the report needs a --season"
+    if args.coefs is None and args.models == list(models):
+        args.coefs = list(coefs)
+
+    model = build_soup(args.models, args.coefs, args.calib_images, args.season)
+    fname = registry.weights_path(args.name, MODEL_DIR)
+    torch.save(model.state_dict(), fname)
+    logging.info(f"Soup saved to {fname}.")
+    if not args.no_report:
+        report(model, args.models, args.season, args.coefs)
@@ -1,9 +1,22 @@
 from fastai.vision import *
 from datetime import datetime
+import argparse
+import json
 import logging
-from assets.models import pretrainedmodels
-from assets.models import efficientnets
+import multiprocessing as mp
+import tempfile
+import threading
+import time
+from torchvision.models import resnext50_32x4d, resnext101_32x8d
+from assets.models import fold
+from assets.models import layout
+from assets.models import registry
 from assets import utils
+from assets import inference
+from assets import seqagg
+from assets import journal
+from assets import keyframes
+from assets import submission
 from config import config
 
 path = config.DATA_PATH
@@ -11,19 +24,21 @@ path = config.DATA_PATH
 logging.basicConfig(level=logging.INFO)
 
 vision.data.open_image = utils.open_croped_image1
+utils.DRAFT_SIZE = config.DRAFT_SIZE
+utils.skip_bad_files(config.IMAGE_SCAN, path)
 
+MODEL_DIR = "assets/models"
 
-def perform_inference():
-    """This is the main function executed at runtime in the cloud environment. """
-    logging.info("Loading model.")
-    
+
+def load_test_metadata():
+    """Test frames sorted by file name, with the sequence id both as index and as a column. """
     logging.info("Loading and processing metadata.")
     # our preprocessing selects the first image for each sequence
     test_metadata = pd.read_csv(path+"test_metadata.csv", index_col="seq_id")
     print("total images",test_metadata.shape)
     test_metadata["sid"]=test_metadata.index
     test_metadata["seq_id"]=test_metadata.index
-    
+
 #     filename=test_metadata.groupby("sid")["file_name"].apply(';'.join)
 #     test_metadata=test_metadata.groupby("sid").first()
 #     test_metadata["file_name2"] = filename
@@ -37,122 +52,447 @@ def perform_inference():
     ################################################
     #test_metadata = test_metadata.sample(100)
     #################################################
+    return test_metadata
 
-    logging.info("Loading as databunch.")
-    
-#     learn = load_learner('assets/')
-    df=pd.read_csv("assets/train.csv")
-    src = (ImageList.from_df(path="",folder=path, df=df, cols="file_name").split_none()
-       .label_from_df(cols='labels', label_delim=';'))
-
-
-
-    # B3
-    logging.info("B3 ...")
-    vision.data.open_image = utils.open_croped_image1
-    data = (src.transform(get_transforms(), size=(128*3,256*2)).databunch(bs=64).normalize(imagenet_stats))
-
-    B="b3"
-    model_name = 'efficientnet-'+B
-    model = efficientnets.EfficientNet.from_name(model_name)
-    model.add_module('_fc',nn.Linear(1536, 54))
-    learn = Learner(data, model, wd=1e-2, bn_wd=False, true_wd=True,model_dir="assets/models")
-    learn.data.add_test(ImageList.from_df(path=path, df=test_metadata, cols='file_name'))
-    learn.data.batch_size = 32 # 
-    learn.load("model_b3")
-    p4, y = learn.get_preds(DatasetType.Test)
-
-
-
-    # B1
-    logging.info("B1 ...")
-    vision.data.open_image = utils.open_croped_image1
-    data = (src.transform(get_transforms(), size=(128*3,256*2)).databunch(bs=128).normalize(imagenet_stats))
-    B="b1"
-    model_name = 'efficientnet-'+B
-    model = efficientnets.EfficientNet.from_name(model_name)
-    model.add_module('_fc',nn.Linear(1280, 54))
-    learn = Learner(data, model, wd=1e-2, bn_wd=False, true_wd=True,model_dir="assets/models")
-    learn.load("model_b1_season10")
-    learn.data.add_test(ImageList.from_df(path=path, df=test_metadata, cols='file_name'))
-    learn.data.batch_size = 32 # 
-
-    p5, y = learn.get_preds(DatasetType.Test)
-
-
-    # seresnext50 3x
-    vision.data.open_image = utils.open_croped_image1
-    data = (src.transform(get_transforms(), size=(128*3,256*2)).databunch(bs=16).normalize(imagenet_stats))
-    learn = cnn_learner(data, base_arch=get_srx50, cut=-2, custom_head=utils.Head(512*4,len(data.classes), 0.0),model_dir="assets/models") 
-    learn.load("best-sat-0075")
-    
-    learn.data.add_test(ImageList.from_df(path=path, df=test_metadata, cols='file_name'))
-    learn.data.batch_size = 32 # 
-
-    logging.info("Starting inference.")
-    logging.info("next ...")
-    inference_start = datetime.now()
-    p1, y = learn.get_preds(DatasetType.Test)
 
-    logging.info("next ...")
-    learn.load("best-thu")
-    p2, y = learn.get_preds(DatasetType.Test)
+def load_members(ensemble=None, channels_last=False, int8=False):
+    """Builds every model of the `ensemble` (default: config.ENSEMBLE) from its registered weights,
+    for NHWC batches if `channels_last`, or loads their int8 artifacts if `int8`. """
+    # the int8 kernels only run on the CPU, so the batches have to stay there too
+    if int8: defaults.device = torch.device("cpu")
+    members = []
+    for name, model in ifnone(ensemble, config.ENSEMBLE):
+        logging.info(f"{name}: {model} ...")
+        model = registry.load_model(model, MODEL_DIR, defaults.device, channels_last=channels_last, int8=int8)
+        members.append(inference.EnsembleMember(name, model))
 
-    logging.info("next ...")
-    learn.load("model_srx50")
-    p3, y = learn.get_preds(DatasetType.Test)
+    # flipped images are scored in memory from the same batches, see config.TTA_POLICY
+    inference.apply_tta_policy(members, config.TTA_POLICY)
+    return members
 
-    # flipped images
-    logging.info("next ...")
-    vision.data.open_image = utils.open_croped_image_flipped
-    data = (src.transform(get_transforms(), size=(128*3,256*2)).databunch(bs=32).normalize(imagenet_stats))
-    learn.data=data
-    learn.load("model_srx50")
-    p3a, y = learn.get_preds(DatasetType.Test)
 
-    ##############
-    # break the bone
-    ######################################
+def aggregate(agg, preds):
+    """Sequence predictions from frame `preds` with the `seqagg.SeqAggregator` `agg`. """
+    # gmean works better for empty images
+    return agg.combine(preds, how="mean", per_class={14: "gmean"})  # f15
+
+
+def cascade_preds(members, frames, agg, cascade, num_workers=defaults.cpus, bf16=False, blend_weights=None,
+                  channels_last=False):
+    """Blended frame predictions where only the frames (or whole sequences) that the cheap `cascade["gate"]`
+    member is unsure about go through the rest of the ensemble, the others keep the gate's predictions.
+    Returns the predictions and the mask of escalated frames. """
+    gate = [m for m in members if m.name == cascade["gate"]]
+    rest = [m for m in members if m.name != cascade["gate"]]
+    dl = inference.image_dl(frames, path, size=registry.INPUT_SIZE, bs=32, num_workers=num_workers,
+                            channels_last=channels_last)
+    gate_preds = inference.ensemble_preds(gate, dl, bf16=bf16)
+    preds = gate_preds[cascade["gate"]].numpy()
+
+    band = dict(empty_idx=registry.CLASSES.index("empty"), empty_band=cascade["empty_band"],
+                min_margin=cascade["min_margin"])
+    if cascade["level"] == "seq":
+        unsure = agg.expand(inference.uncertain(aggregate(agg, preds), **band))
+    else:
+        unsure = inference.uncertain(preds, **band)
+
+    preds = preds.copy()
+    if unsure.any():
+        dl = inference.image_dl(frames[unsure], path, size=registry.INPUT_SIZE, bs=32, num_workers=num_workers,
+                                channels_last=channels_last)
+        escalated = inference.ensemble_preds(rest, dl, bf16=bf16)
+        escalated.update({n: p[torch.from_numpy(unsure)] for n, p in gate_preds.items()})
+        preds[unsure] = inference.blend(escalated, ifnone(blend_weights, config.BLEND_WEIGHTS)).numpy()
+    logging.info(f"cascade: {unsure.mean():.1%} of {len(frames)} images escalated")
+    return preds, unsure
+
+
+def select_frames(frames, frame_budget, num_workers=defaults.cpus):
+    """The `frame_budget` frames of every sequence that differ most from its background, see `assets.keyframes`. """
+    keep = keyframes.select(frames.seq_id.values, [path+f for f in frames.file_name], frame_budget,
+                            workers=max(1, num_workers))
+    logging.info(f"frame budget {frame_budget}: scoring {keep.sum()} of {len(frames)} images")
+    return frames[keep]
+
+
+def predict_sequences(members, frames, num_workers=defaults.cpus, bf16=False, cascade=None, blend_weights=None,
+                      frame_budget=None, channels_last=False):
+    """Scores all `frames` with the ensemble and aggregates them per sequence, in NHWC batches if `channels_last`.
+    With a `cascade` config (see config.CASCADE) the ensemble runs as a cascade, see `cascade_preds`.
+    With a `frame_budget` only that many frames of every sequence are scored, see `select_frames`. """
+    blend_weights = ifnone(blend_weights, config.BLEND_WEIGHTS)
+    if frame_budget is not None:
+        frames = select_frames(frames, frame_budget, num_workers)
+    agg = seqagg.SeqAggregator(frames.seq_id.values)
+    if cascade is not None:
+        preds, _ = cascade_preds(members, frames, agg, cascade, num_workers, bf16, blend_weights, channels_last)
+        return agg.seq_ids, aggregate(agg, preds)
+
+    # one dataloader (and so one decode + resize per image) shared by every model
+    dl = inference.image_dl(frames, path, size=registry.INPUT_SIZE, bs=32, num_workers=num_workers,
+                            channels_last=channels_last)
+    preds = inference.ensemble_preds(members, dl, bf16=bf16)
 
     # PREDICTIONS AVG
-    preds =p1*.05 + p2*.05 + p3*.4 +p3a*.4 + p4*.05 + p5*.05 
-        
-
-    inference_stop = datetime.now()
-    logging.info(f"Inference complete. Took {inference_stop - inference_start}.")
-    
-    preds = pd.DataFrame(preds.numpy(), columns = ["f"+str(i+1) for i in range(54)])
-    preds.index = test_metadata.seq_id
-    
-    # gmean works better for empty images
-    gmean = preds.sort_values('seq_id').groupby('seq_id').apply(lambda group: group.product() ** (1 / float(len(group))))
+    preds = inference.blend(preds, blend_weights)
+    return agg.seq_ids, aggregate(agg, preds.numpy())
+
+
+# models of a sharded inference worker process, see `ShardedPredictor`
+_worker = {}
+
+
+def _init_worker(threads, ensemble, int8, options, ready):
+    torch.set_num_threads(threads)
+    try:
+        _worker["members"] = load_members(ensemble, options.get("channels_last", False), int8)
+    except BaseException:
+        # the pool would respawn the worker forever and the parent would keep waiting for it
+        ready.abort()
+        raise
+    _worker["options"] = options
+    ready.wait()
+
+
+def _predict_shard(frames):
+    # the worker processes themselves use all the cores, images are decoded in-process
+    return predict_sequences(_worker["members"], frames, num_workers=0, **_worker["options"])
+
+
+class ShardedPredictor():
+    """Splits frames by seq_id across `workers` processes with `threads` intra-op threads each.
+    Every worker loads the models once (their int8 artifacts if `int8`); their per-shard sequence predictions
+    are merged back together. `options` are passed on to `predict_sequences`. Raises if a worker fails to load
+    the models or they are not all loaded within `timeout` seconds. """
+    def __init__(self, workers, threads=None, ensemble=None, int8=False, timeout=600, **options):
+        self.workers = workers
+        threads = ifnone(threads, max(1, os.cpu_count() // workers))
+        logging.info(f"Starting {workers} workers with {threads} threads each.")
+        ctx = mp.get_context("spawn")
+        ready = ctx.Barrier(workers + 1)
+        self.pool = ctx.Pool(workers, initializer=_init_worker, initargs=(threads, ensemble, int8, options, ready))
+        # returns once every worker has its models loaded
+        try:
+            ready.wait(timeout)
+        except threading.BrokenBarrierError:
+            self.pool.terminate()
+            raise RuntimeError(f"a worker failed to load the models (see its traceback above) or they were not "
+                               f"all loaded within {timeout} seconds") from None
+
+    def __call__(self, frames):
+        shards = self.pool.map(_predict_shard, inference.seq_shards(frames, self.workers))
+        return np.concatenate([s[0] for s in shards]), np.concatenate([s[1] for s in shards])
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+def perform_inference(chunk_size=config.STREAM_CHUNK_SIZE, workers=1, threads=None, bf16=False, cascade=False,
+                      soup=False, frame_budget=None, channels_last=False, int8=False):
+    """This is the main function executed at runtime in the cloud environment.
+    With `chunk_size` set the test set is processed `chunk_size` sequences at a time and
+    every chunk is appended to the submission as soon as it is done, so memory stays bounded and a crashed run
+    resumes at the first unfinished chunk.
+    With `workers` > 1 every chunk is sharded by sequence across that many CPU processes.
+    With `bf16` the models run under bfloat16 CPU autocast.
+    With `cascade` only the images config.CASCADE's gate model is unsure about are scored by the whole ensemble.
+    With `soup` the weight-averaged SE-ResNeXt50 of make_soup.py replaces the three separate ones.
+    With a `frame_budget` only that many of the most informative frames of every sequence are scored.
+    With `channels_last` images are batched NHWC and the models run in that layout.
+    With `int8` the int8 artifacts of quantize_models.py are run instead of the float models, on the CPU. """
+    logging.info("Loading model.")
 
-    preds = preds.sort_values('seq_id').groupby('seq_id').mean()
-    preds["f15"] = gmean["f15"]
-    preds = preds.values
+    test_metadata = load_test_metadata()
 
     logging.info("Setting up submission file.")
     submission_format = pd.read_csv(path+"submission_format.csv", index_col=0)
-    # Check our predictions are in the same order as the submission format
-    assert np.all(
-        test_metadata.seq_id.unique().tolist() == submission_format.index.to_list()
-    )
+    submission_index = submission_format.index
+    writer = submission.SubmissionWriter(registry.CLASSES, submission_format.columns,
+                                         index_label=ifnone(submission_index.name, "seq_id"))
+    del submission_format
+
+    ensemble = config.SOUP_ENSEMBLE if soup else config.ENSEMBLE
+    options = {"bf16": bf16, "cascade": config.CASCADE if cascade else None, "frame_budget": frame_budget,
+               "blend_weights": config.SOUP_BLEND_WEIGHTS if soup else config.BLEND_WEIGHTS,
+               "channels_last": channels_last}
+    if workers > 1:
+        predictor = ShardedPredictor(workers, threads, ensemble, int8, **options)
+    else:
+        predictor = partial(predict_sequences, load_members(ensemble, channels_last, int8), **options)
+
+    # chunks recorded in the journal by a previous, interrupted run are not computed again
+    run_config = {"ensemble": ensemble, "tta": config.TTA_POLICY, "chunk_size": chunk_size, "digits": writer.digits,
+                  "draft_size": config.DRAFT_SIZE, "int8": int8, **options}
+    weights = [(registry.int8_path if int8 else registry.weights_path)(model, MODEL_DIR) for _, model in ensemble]
+    fingerprint = journal.fingerprint(weights, run_config)
+    progress = journal.InferenceJournal("submission.csv", fingerprint)
 
+    logging.info("Starting inference.")
+    inference_start = datetime.now()
+    chunks = inference.seq_chunks(test_metadata, submission_index, ifnone(chunk_size, len(submission_index)))
+    for i, (chunk_index, frames) in enumerate(chunks):
+        if progress.is_done(i, chunk_index):
+            logging.info(f"chunk {i}: done in a previous run")
+            continue
+        logging.info(f"chunk {i}: {len(chunk_index)} sequences, {len(frames)} images")
+        seq_ids, preds = predictor(frames)
+
+        # Save out submission to root of directory
+        header = progress.start(i)
+        with open("submission.csv", "ab") as f:
+            writer.write(f, preds, seq_ids, chunk_index, header=header)
+        progress.commit(i, chunk_index)
+
+    if workers > 1: predictor.close()
 
+    inference_stop = datetime.now()
+    logging.info(f"Inference complete. Took {inference_stop - inference_start}.")
+    logging.info(f"Submission saved.")
 
-    for c in submission_format.columns:
-        if c in learn.data.classes:
-            idx = learn.data.classes.index(c)
-            print(idx)
-            submission_format[c] = preds[:, idx]
 
+def benchmark_sample(n_seqs):
+    """Frames of the first `n_seqs` test sequences. """
+    test_metadata = load_test_metadata()
+    return test_metadata[test_metadata.seq_id.isin(test_metadata.seq_id.unique()[:n_seqs])]
+
+
+def benchmark_workers(max_workers, threads=None, n_seqs=256):
+    """Images per second of sharded inference on the first `n_seqs` test sequences
+    for 1, 2, 4 ... `max_workers` worker processes, model loading excluded. """
+    frames = benchmark_sample(n_seqs)
+    counts = sorted(set([2**i for i in range(max_workers.bit_length()) if 2**i <= max_workers] + [max_workers]))
+
+    results = []
+    for n in counts:
+        predictor = ShardedPredictor(n, threads)
+        start = time.perf_counter()
+        predictor(frames)
+        elapsed = time.perf_counter() - start
+        predictor.close()
+        results.append({"workers": n, "images": len(frames), "seconds": round(elapsed, 3),
+                        "images_per_sec": round(len(frames) / elapsed, 2),
+                        "speedup": round(results[0]["seconds"] / elapsed, 2) if results else 1.0})
+        logging.info(f"{n} workers: {results[-1]['images_per_sec']} images/s, x{results[-1]['speedup']}")
+    print(json.dumps(results, indent=2))
+    return results
+
+
+def benchmark_engine(n_seqs=256, num_workers=defaults.cpus):
+    """Images per second of the ensemble on the first `n_seqs` test sequences with the fastai
+    image pipeline and with the plain DataLoader, in fp32 and in bfloat16, and the largest absolute
+    difference of their predictions to the ones of the fastai pipeline. """
+    frames = benchmark_sample(n_seqs)
+    members = load_members()
+    dls = {
+        "fastai": lambda: inference.test_dl(frames, path, registry.INPUT_SIZE, 32, num_workers),
+        "plain": lambda: inference.image_dl(frames, path, registry.INPUT_SIZE, 32, num_workers),
+    }
+    results, reference = [], None
+    for loader, bf16 in [("fastai", False), ("plain", False), ("plain", True)]:
+        start = time.perf_counter()
+        preds = inference.ensemble_preds(members, dls[loader](), bf16=bf16)
+        elapsed = time.perf_counter() - start
+        reference = ifnone(reference, preds)
+        diff = max((preds[k] - reference[k]).abs().max().item() for k in preds)
+        results.append({"loader": loader, "bf16": bf16, "images": len(frames), "seconds": round(elapsed, 3),
+                        "images_per_sec": round(len(frames) / elapsed, 2), "max_abs_diff": diff})
+        logging.info(f"{loader}{' bf16' if bf16 else ''}: {results[-1]['images_per_sec']} images/s")
+    print(json.dumps(results, indent=2))
+    return results
+
+
+def benchmark_writer(n_seqs=1000000, n_pandas=100000):
+    """Seconds to write a random `n_seqs` x 54 submission with the submission writer,
+    and with `DataFrame.to_csv` for `n_pandas` of the rows. """
+    rng = np.random.RandomState(0)
+    seq_ids = np.array([f"SEQ#{i}" for i in range(n_seqs)], dtype=object)
+    preds = rng.rand(n_seqs, len(registry.CLASSES)).astype(np.float32)
+    index = seq_ids[rng.permutation(n_seqs)]
+    writer = submission.SubmissionWriter(registry.CLASSES, registry.CLASSES)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, "submission.csv")
+        start = time.perf_counter()
+        with open(fname, "wb") as f:
+            writer.write(f, preds, seq_ids, index)
+        results.append({"writer": "SubmissionWriter", "rows": n_seqs, "seconds": round(time.perf_counter() - start, 2)})
+
+        rows = pd.Index(seq_ids).get_indexer(index[:n_pandas])
+        start = time.perf_counter()
+        pd.DataFrame(preds[rows], index=index[:n_pandas], columns=registry.CLASSES).astype(np.float64).to_csv(fname)
+        results.append({"writer": "DataFrame.to_csv", "rows": n_pandas, "seconds": round(time.perf_counter() - start, 2)})
+    for r in results:
+        r["rows_per_sec"] = round(r["rows"] / r["seconds"])
+    print(json.dumps(results, indent=2))
+    return results
+
+
+def load_season(season, n_seqs=None):
+    """Frames of the labeled training `season` (optionally only its first `n_seqs` sequences) and their labels.
+    No season is held out of the ensemble (model_b3 is trained on all of them), so log losses on it are in-sample. """
+    train_metadata = pd.read_csv(path+"train_metadata.csv")
+    frames = train_metadata[train_metadata.seq_id.str.startswith(f"SER_{season}#")]
+    if n_seqs is not None:
+        frames = frames[frames.seq_id.isin(frames.seq_id.unique()[:n_seqs])]
+    train_labels = pd.read_csv(path+"train_labels.csv", index_col="seq_id")
+    return frames, train_labels[registry.CLASSES]
+
+
+def benchmark_decode(n_images=200):
+    """Decode time of the first `n_images` test images with and without JPEG draft decoding,
+    and the pixel difference it makes after the validation transforms to the models' input size. """
+    frames = load_test_metadata().iloc[:n_images]
+    res = utils.draft_parity([path+f for f in frames.file_name], registry.INPUT_SIZE, config.DRAFT_SIZE)
+    print(json.dumps(res, indent=2))
+    return res
+
+
+def benchmark_models(**kwargs):
+    """(name, constructor) of every ensemble model, with `kwargs` for `registry.load_model`, followed by the
+    2nd Place ResNeXts with random weights. """
+    models = [(m, partial(registry.load_model, m, MODEL_DIR, **kwargs))
+              for m in dict.fromkeys(m for _, m in config.ENSEMBLE)]
+    return models + [(arch.__name__, partial(arch, num_classes=len(registry.CLASSES)))
+                     for arch in [resnext50_32x4d, resnext101_32x8d]]
+
+
+def benchmark_fold(batch_size=8, iters=10):
+    """Latency per batch of every ensemble model and of the 2nd Place ResNeXts (random weights) before and after
+    folding their BatchNorms into the convolutions, each checked for equal outputs on the same random batch. """
+    x = torch.randn(batch_size, 3, *registry.INPUT_SIZE)
+    results = []
+    for name, build in benchmark_models(fold_bn=False):
+        results.append({"model": name, "batch_size": batch_size, **fold.benchmark(build(), x, iters)})
+        logging.info(f"{name}: {results[-1]}")
+    print(json.dumps(results, indent=2))
+    return results
+
+
+def benchmark_layout(batch_size=8, iters=10):
+    """Images per second of every ensemble model and of the 2nd Place ResNeXts in NCHW and in channels_last,
+    each checked to keep the NHWC layout through all of its layers. """
+    x = torch.randn(batch_size, 3, *registry.INPUT_SIZE)
+    results = []
+    for name, build in benchmark_models():
+        res = layout.benchmark(build(), x, iters)
+        res.update({"model": name, "batch_size": batch_size,
+                    "images_per_sec": round(1000 * batch_size / res["ms_per_batch"], 2),
+                    "channels_last_images_per_sec": round(1000 * batch_size / res["channels_last_ms_per_batch"], 2)})
+        results.append(res)
+        logging.info(f"{name}: x{res['speedup']} in channels_last")
+    print(json.dumps(results, indent=2))
+    return results
+
+
+def evaluate_cascade(season, n_seqs=None):
+    """Fraction of images the cascade escalates and its log loss against the full ensemble
+    on the sequences of the labeled training `season` (optionally only the first `n_seqs`).
+    Both log losses are in-sample and optimistic, only their difference is meaningful. """
+    frames, labels = load_season(season, n_seqs)
+    members = load_members()
+    agg = seqagg.SeqAggregator(frames.seq_id.values)
+    y_true = labels.loc[agg.seq_ids].values
+
+    start = time.perf_counter()
+    _, full = predict_sequences(members, frames)
+    full_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    preds, escalated = cascade_preds(members, frames, agg, config.CASCADE)
+    cascade_seconds = time.perf_counter() - start
+    cascade = aggregate(agg, preds)
+
+    report = {"season": season, "sequences": len(agg), "images": len(frames),
+              "escalated_images": round(float(escalated.mean()), 4),
+              "escalated_sequences": round(len(np.unique(agg.inverse[escalated])) / len(agg), 4),
+              "log_loss_full": round(inference.log_loss(y_true, full), 5),
+              "log_loss_cascade": round(inference.log_loss(y_true, cascade), 5),
+              "seconds_full": round(full_seconds, 2), "seconds_cascade": round(cascade_seconds, 2)}
+    report["log_loss_delta"] = round(report["log_loss_cascade"] - report["log_loss_full"], 5)
+    print(json.dumps(report, indent=2))
+    return report
+
+
+def benchmark_frame_budget(season, n_seqs=1000, budgets=(None, 1, 2, 3)):
+    """Sequences per second and sequence-level log loss on the labeled training `season` (first `n_seqs`
+    sequences) when scoring all frames and the top 1, 2, 3 ... frames of every sequence. The log losses
+    are in-sample and optimistic, only their differences are meaningful. """
+    frames, labels = load_season(season, n_seqs)
+    members = load_members()
+    results = []
+    for budget in budgets:
+        start = time.perf_counter()
+        seq_ids, preds = predict_sequences(members, frames, frame_budget=budget)
+        elapsed = time.perf_counter() - start
+        results.append({"frame_budget": budget, "sequences": len(seq_ids), "seconds": round(elapsed, 2),
+                        "sequences_per_sec": round(len(seq_ids) / elapsed, 2),
+                        "speedup": round(results[0]["seconds"] / elapsed, 2) if results else 1.0,
+                        "log_loss": round(inference.log_loss(labels.loc[seq_ids].values, preds), 5)})
+        logging.info(f"frame budget {budget}: {results[-1]}")
+    print(json.dumps(results, indent=2))
+    return results
+
+
+def frame_budget_arg(value):
+    """--frame-budget: at least one frame per sequence. """
+    if int(value) < 1: raise argparse.ArgumentTypeError(f"must keep at least 1 frame per sequence, got {value}")
+    return int(value)
 
-    # We want to ensure all of our data are floats, not integers
-    my_submission = submission_format.astype(np.float)
 
-    # Save out submission to root of directory
-    my_submission.to_csv("submission.csv", index=True)
-    logging.info(f"Submission saved.")
-    
 if __name__ == "__main__":
-    perform_inference()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunk-size", type=int, default=config.STREAM_CHUNK_SIZE,
+                        help="stream the test set this many sequences at a time, a rerun after a crash resumes at the "
+                             "first unfinished chunk (default: config.STREAM_CHUNK_SIZE)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="shard the test set by sequence across this many processes")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="intra-op threads per worker (default: cores / workers)")
+    parser.add_argument("--bf16", action="store_true",
+                        help="run the models under bfloat16 CPU autocast")
+    parser.add_argument("--cascade", action="store_true",
+                        help="score every image with the cheap gate model first and escalate only the uncertain "
+                             "ones to the whole ensemble, see config.CASCADE")
+    parser.add_argument("--soup", action="store_true",
+                        help="use the weight-averaged SE-ResNeXt50 written by make_soup.py, see config.SOUP_ENSEMBLE")
+    parser.add_argument("--frame-budget", type=frame_budget_arg, default=config.FRAME_BUDGET,
+                        help="score only this many frames per sequence, those differing most from the background")
+    parser.add_argument("--channels-last", action="store_true",
+                        help="batch the images NHWC and run the models in channels_last memory layout")
+    parser.add_argument("--int8", action="store_true",
+                        help="run the int8 models written by quantize_models.py, on the CPU")
+    parser.add_argument("--benchmark",
+                        choices=["workers", "engine", "cascade", "writer", "frames", "decode", "fold", "layout"],
+                        default=None,
+                        help="instead of predicting, report throughput for 1, 2, 4 ... --workers processes, "
+                             "for the fastai and plain image pipelines, the cascade against the full "
+                             "ensemble on the labeled --season, the speed of writing the submission, "
+                             "throughput and log loss for frame budgets of 1, 2, 3 on the labeled --season, "
+                             "JPEG draft decoding against full decoding, the models with and without folded "
+                             "BatchNorms, or the models in NCHW against channels_last")
+    parser.add_argument("--season", default=None,
+                        help="labeled training season of --benchmark cascade and frames; every season is in the "
+                             "training data of the ensemble, so their log losses are in-sample and optimistic")
+    args = parser.parse_args()
+    assert args.season or args.benchmark not in ["cascade", "frames"], f"--benchmark {args.benchmark} needs a --season"
+    if args.benchmark == "workers":
+        benchmark_workers(args.workers, args.threads)
+    elif args.benchmark == "engine":
+        benchmark_engine()
+    elif args.benchmark == "cascade":
+        evaluate_cascade(args.season)
+    elif args.benchmark == "writer":
+        benchmark_writer()
+    elif args.benchmark == "frames":
+        benchmark_frame_budget(args.season)
+    elif args.benchmark == "decode":
+        benchmark_decode()
+    elif args.benchmark == "fold":
+        benchmark_fold()
+    elif args.benchmark == "layout":
+        benchmark_layout()
+    else:
+        perform_inference(chunk_size=args.chunk_size, workers=args.workers, threads=args.threads, bf16=args.bf16,
+                          cascade=args.cascade, soup=args.soup, frame_budget=args.frame_budget,
+                          channels_last=args.channels_last, int8=args.int8)
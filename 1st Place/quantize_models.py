@@ -0,0 +1,99 @@
+from fastai.vision import *
+import argparse
+import json
+import logging
+from assets.models import quantize
+from assets.models import registry
+from assets import inference
+from assets import seqagg
+from assets import utils
+from config import config
+
+path = config.DATA_PATH
+logging.basicConfig(level=logging.INFO)
+
+utils.DRAFT_SIZE = config.DRAFT_SIZE
+
+MODEL_DIR = "assets/models"
+
+
+def season_frames(train_metadata, season):
+    return train_metadata.seq_id.str.startswith(f"SER_{season}#")
+
+
+def calibration_dl(train_metadata, n_images, season=None, bs=32, num_workers=defaults.cpus):
+    """Random sample of `n_images` training images to calibrate the activation ranges on, outside of `season`. """
+    frames = train_metadata if season is None else train_metadata[~season_frames(train_metadata, season)]
+    frames = frames.sample(min(n_images, len(frames)), random_state=0)
+    return inference.image_dl(frames, path, size=registry.INPUT_SIZE, bs=bs, num_workers=num_workers)
+
+
+def quantize_models(models, season, calib_images=512, n_seqs=None, backend=quantize.BACKEND, bs=32, iters=10,
+                    num_workers=defaults.cpus):
+    """Quantizes the registered `models` to int8, calibrated on `calib_images` training images, and saves them next
+    to their weights. Reports the log loss of every model before and after, in total and per class, on the
+    sequences of the labeled training `season` (optionally only the first `n_seqs`), and its latency per batch.
+    The models are trained on every season, so the log losses are in-sample; the deltas are what to look at. """
+    # the int8 kernels only run on the CPU
+    defaults.device = torch.device("cpu")
+    train_metadata = pd.read_csv(path+"train_metadata.csv")
+    calib = calibration_dl(train_metadata, calib_images, season, bs, num_workers)
+    x = torch.randn(bs, 3, *registry.INPUT_SIZE)
+
+    members, results = [], {}
+    for name in models:
+        logging.info(f"{name}: calibrating on {calib_images} images with the {backend} backend.")
+        # the BatchNorms are fused by the quantization itself; the float reference runs like in predict.py
+        quantized = quantize.quantize_model(registry.load_model(name, MODEL_DIR, fold_bn=False),
+                                            (xb for xb, _ in calib), x, backend)
+        fname = registry.int8_path(name, MODEL_DIR)
+        quantize.save_int8(quantized, fname, backend)
+        logging.info(f"{name}: int8 model saved to {fname}.")
+        model = registry.load_model(name, MODEL_DIR)
+        members += [inference.EnsembleMember(name, model), inference.EnsembleMember(name + "_int8", quantized)]
+        results[name] = {"artifact": fname, "backend": backend, "batch_size": bs,
+                         **quantize.benchmark(model, quantized, x, iters)}
+
+    frames = train_metadata[season_frames(train_metadata, season)]
+    if n_seqs is not None:
+        frames = frames[frames.seq_id.isin(frames.seq_id.unique()[:n_seqs])]
+    agg = seqagg.SeqAggregator(frames.seq_id.values)
+    train_labels = pd.read_csv(path+"train_labels.csv", index_col="seq_id")
+    y_true = train_labels.loc[agg.seq_ids, registry.CLASSES].values
+    dl = inference.image_dl(frames, path, size=registry.INPUT_SIZE, bs=bs, num_workers=num_workers)
+    preds = inference.ensemble_preds(members, dl)
+    # same sequence aggregation as predict.py
+    seq_preds = {n: agg.combine(p.numpy(), how="mean", per_class={14: "gmean"}) for n, p in preds.items()}  # f15
+    for name in models:
+        results[name].update({"season": season, "sequences": len(agg), "images": len(frames)})
+        results[name].update(quantize.log_loss_deltas(registry.CLASSES, y_true, seq_preds[name],
+                                                      seq_preds[name + "_int8"]))
+    return results
+
+
+if __name__ == "__main__":
+    models = list(dict.fromkeys(m for _, m in config.ENSEMBLE))
+    parser = argparse.ArgumentParser(description="Quantize the registered models to int8 for CPU inference")
+    parser.add_argument("--models", nargs="+", default=models, choices=list(registry.REGISTRY),
+                        help="registered models to quantize, written next to their weights as <name>.int8.ts")
+    parser.add_argument("--calib-images", type=int, default=512,
+                        help="training images the activation ranges are calibrated on")
+    parser.add_argument("--season", required=True,
+                        help="labeled season the report is computed on, left out of the calibration sample; the "
+                             "models are trained on every season, so its log losses are in-sample and optimistic")
+    parser.add_argument("--n-seqs", type=int, default=None, help="only report on the first sequences of --season")
+    parser.add_argument("--backend", default=quantize.BACKEND, choices=torch.backends.quantized.supported_engines,
+                        help="quantized kernels the models are converted for and run with")
+    parser.add_argument("--batch-size", type=int, default=32, help="batch size of the calibration and the latency")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads")
+    parser.add_argument("--report", default="quantization_report.json",
+                        help="per-class log loss deltas and latency of every model")
+    args = parser.parse_args()
+    if args.threads: torch.set_num_threads(args.threads)
+
+    results = quantize_models(args.models, args.season, args.calib_images, args.n_seqs, args.backend, args.batch_size)
+    with open(args.report, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps({name: {k: v for k, v in r.items() if k != "class_log_loss_delta"}
+                      for name, r in results.items()}, indent=2))
+    logging.info(f"Report with the per-class log loss deltas saved to {args.report}.")
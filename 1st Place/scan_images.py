@@ -0,0 +1,25 @@
+import argparse
+import logging
+import os
+import pandas as pd
+from assets import imagescan
+from config import config
+
+path = config.DATA_PATH
+logging.basicConfig(level=logging.INFO)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate every image of the metadata csvs once, see assets/imagescan.py")
+    parser.add_argument("--metadata", nargs="+", default=["train_metadata.csv", "test_metadata.csv"],
+                        help="metadata csvs in the data directory whose file_name column is scanned")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="decoding processes")
+    args = parser.parse_args()
+
+    file_names = []
+    for csv in args.metadata:
+        if os.path.exists(path+csv):
+            file_names.extend(pd.read_csv(path+csv, usecols=["file_name"]).file_name)
+    validated, bad = imagescan.scan(path, file_names, config.IMAGE_SCAN, args.workers)
+    print(f"{validated} files validated, {bad} of {len(set(file_names))} files bad, recorded in {config.IMAGE_SCAN}")
+    for f, error in sorted(imagescan.bad_files(config.IMAGE_SCAN, file_names).items()):
+        print(f"\t{f}\t{error}")
@@ -1,3 +1,6 @@
+python3 scan_images.py
+python3 create_chunk_manifests.py
+
 python3 train_hakuna_seasonal-chunks_eff1.py
 python3 train_hakuna_seasonal-chunks_srx50.py
 
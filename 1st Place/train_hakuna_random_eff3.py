@@ -1,7 +1,10 @@
 from assets.utils import *
 from config import config
 
+args = training_args()
+
 path = config.DATA_PATH
+skip_bad_files(config.IMAGE_SCAN, path)
 train_metadata = pd.read_csv(path+"train_metadata_with_labels.csv")
 train_labels = pd.read_csv(path+"train_labels.csv", index_col="seq_id")
 
@@ -26,6 +29,8 @@ learn = Learner(data,
                 true_wd=True,
                 metrics=[acc_02, f_score],
                )
+if args.bf16:
+    learn.callback_fns.append(BF16Autocast)
 
 learn.unfreeze()
 learn.fit_one_cycle(1, 
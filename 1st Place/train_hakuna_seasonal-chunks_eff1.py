@@ -1,13 +1,21 @@
 from assets.utils import *
+from assets import manifest
+from assets import prefetch
 from config import config
 
+args = training_args()
+
 # torch.cuda.set_device(0)
 
 path = config.DATA_PATH# Change if you have the imagery mounted at a different location
+skip_bad_files(config.IMAGE_SCAN, path)
 train_metadata = pd.read_csv(path+"train_metadata_with_labels.csv")
 train_metadata.index=train_metadata.seq_id
 train_labels = pd.read_csv(path+"train_labels.csv", index_col="seq_id")
 chunks = pd.read_csv(path+"train_in_chunks_per_season.csv", index_col="seq_id")
+# reads the images of the next chunk ahead while the current one trains
+prefetcher = prefetch.ChunkPrefetcher(path, train_metadata.file_name, chunks["chunk"],
+                                      budget=config.PREFETCH_BYTES, staging_dir=config.PREFETCH_STAGING_DIR)
 
 SZ=(384,512)
 # SZ=(192,256)
@@ -29,22 +37,23 @@ learn = Learner(data, model, wd=1e-2,model_dir="assets/models",
                    bn_wd=False, true_wd=True,
                     metrics=[acc_02, f_score],
                )
+if args.bf16:
+    learn.callback_fns.append(BF16Autocast)
 learn.unfreeze()
 
-def train_on_chunk(path, learn, chunk, train_metadata):
+def train_on_chunk(path, learn, chunk):
     """
     This function enables learning only on a subset of the train set which we refer as chunk. 
     Chunks are conmprised of mostly one season but could have two or more.
+    The chunk is read from its manifest (see create_chunk_manifests.py), labelled against the fixed 54 classes.
     """
-    subset = train_metadata.drop(chunks[chunks["chunk"]!=chunk].index).copy()
-    
-    # The line bellow makes sure everytime we create databunch it will have all 54 classes. 
-    # The noise we introduce this way does not humper learning
-    subset.labels[-1] = "aardvark;aardwolf;baboon;bat;batearedfox;buffalo;bushbuck;caracal;cattle;cheetah;civet;dikdik;duiker;eland;elephant;empty;gazellegrants;gazellethomsons;genet;giraffe;guineafowl;hare;hartebeest;hippopotamus;honeybadger;hyenaspotted;hyenastriped;impala;insectspider;jackal;koribustard;leopard;lionfemale;lionmale;mongoose;monkeyvervet;ostrich;otherbird;porcupine;reedbuck;reptiles;rhinoceros;rodents;secretarybird;serval;steenbok;topi;vulture;warthog;waterbuck;wildcat;wildebeest;zebra;zorilla"
-    
-    src = (ImageList.from_df(path=path, df=subset, cols="file_name")
+    prefetcher.start(chunk)
+    relocate = prefetcher.locate if prefetcher.staging_dir is not None else None
+
+    src = (manifest.ManifestImageList.from_manifest(manifest.chunk_manifest(config.MANIFEST_DIR, chunk), path,
+                                                    relocate=relocate)
            .split_none()
-           .label_from_df(cols='labels', label_delim=';')
+           .label_from_manifest()
           )
     data = (src.transform(get_transforms(max_rotate=5,max_warp=0, max_zoom=1.02,
                                          p_affine=.0 , p_lighting=.0,), size=SZ) #512x384
@@ -56,7 +65,7 @@ def train_on_chunk(path, learn, chunk, train_metadata):
 # chunk 1 - Season 7
 
 chunk=1
-learn = train_on_chunk(path, learn, chunk, train_metadata)
+learn = train_on_chunk(path, learn, chunk)
 
 learn.fit_one_cycle(1, 3e-5,
                     pct_start=0.0002, #first 500 epochs slowly increase LR
@@ -68,7 +77,7 @@ learn.fit_one_cycle(1, 3e-5,
 # chunk 2 - Seasons 3, 4 and 51
 
 chunk=2
-learn = train_on_chunk(path, learn, chunk, train_metadata)
+learn = train_on_chunk(path, learn, chunk)
 
 learn.fit_one_cycle(1, 1e-5,
                     pct_start=0.0002, #first 500 epochs slowly increase LR
@@ -80,7 +89,7 @@ learn.fit_one_cycle(1, 1e-5,
 # chunk 3 - Seasons 1, 2 and 6
 
 chunk=3
-learn = train_on_chunk(path, learn, chunk, train_metadata)
+learn = train_on_chunk(path, learn, chunk)
 
 learn.fit_one_cycle(1, 0.8e-5,
                     pct_start=0.0002, #first 500 epochs slowly increase LR
@@ -92,7 +101,7 @@ learn.fit_one_cycle(1, 0.8e-5,
 # chunk 4 - Seasons 5
 
 chunk=4
-learn = train_on_chunk(path, learn, chunk, train_metadata)
+learn = train_on_chunk(path, learn, chunk)
 
 learn.fit(1, 0.3e-5,
                            callbacks = [#BnFreeze(learn), 
@@ -104,7 +113,7 @@ learn.fit(1, 0.3e-5,
 # chunk 5 - Seasons 9
 
 chunk=5
-learn = train_on_chunk(path, learn, chunk, train_metadata)
+learn = train_on_chunk(path, learn, chunk)
 
 learn.fit_one_cycle(1, 0.2e-5,
                     pct_start=0.0002, #first 500 epochs slowly increase LR
@@ -116,7 +125,7 @@ learn.fit_one_cycle(1, 0.2e-5,
 # chunk 6 - Seasons 8
 
 chunk=6
-learn = train_on_chunk(path, learn, chunk, train_metadata)
+learn = train_on_chunk(path, learn, chunk)
 
 learn.fit(1, 0.1e-5,
                            callbacks = [#BnFreeze(learn), 
@@ -126,14 +135,14 @@ learn.fit(1, 0.1e-5,
 # chunk 7- train further with the same season
 
 chunk=7
-learn = train_on_chunk(path, learn, chunk, train_metadata)
+learn = train_on_chunk(path, learn, chunk)
 
 learn.fit(1, 0.1e-5,
                            callbacks = [#BnFreeze(learn), 
                             AccumulateStep(learn,8)
                            ] )
 
-learn = train_on_chunk(path, learn, chunk, train_labels)
+learn = train_on_chunk(path, learn, chunk)
 learn.fit(1, 0.05e-5,
                            callbacks = [#BnFreeze(learn), 
                             AccumulateStep(learn,15)
@@ -143,7 +152,7 @@ learn.fit(1, 0.05e-5,
 # chunk 8 - Seasons 10
 
 chunk=8
-learn = train_on_chunk(path, learn, chunk, train_labels)
+learn = train_on_chunk(path, learn, chunk)
 
 learn.fit(1, 0.1e-5,
                            callbacks = [#BnFreeze(learn), 
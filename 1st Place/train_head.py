@@ -0,0 +1,131 @@
+from fastai.vision import *
+import argparse
+import json
+import logging
+import time
+from assets.models import embed
+from assets.models import registry
+from assets import embeddings
+from assets import inference
+from assets import seqagg
+from config import config
+
+path = config.DATA_PATH
+logging.basicConfig(level=logging.INFO)
+
+MODEL_DIR = "assets/models"
+
+
+class StackedEmbeddings():
+    """Embeddings of the frames of the first of `stores`, concatenated with those of the same frames in the others,
+    gathered from the memory maps batch by batch. """
+    def __init__(self, stores):
+        self.stores, self.index = stores, stores[0].index
+        self.rows = [np.arange(len(self.index))] + [s.rows(self.index.file_name) for s in stores[1:]]
+        self.dim = sum(s.dim for s in stores)
+
+    def __len__(self): return len(self.index)
+
+    def __getitem__(self, idx):
+        return np.concatenate([s[r[idx]] for s, r in zip(self.stores, self.rows)], axis=1)
+
+
+def make_head(dim, hidden=0, p=0.0, num_classes=len(registry.CLASSES)):
+    """A linear classifier like the models' own, or with `hidden` units a two-layer stacker. """
+    if not hidden: return nn.Linear(dim, num_classes)
+    return nn.Sequential(nn.Linear(dim, hidden), nn.ReLU(inplace=True), nn.Dropout(p), nn.Linear(hidden, num_classes))
+
+
+def model_classifier(store):
+    """The classifier of the registered model the embeddings of `store` come from, None for any other model. """
+    name = store.meta.get("model")
+    return embed.classifier(registry.load_model(name, MODEL_DIR)) if name in registry.REGISTRY else None
+
+
+def fit_head(head, X, y, rows, epochs=5, bs=1024, lr=1e-3, wd=1e-4, device=None):
+    """Fits `head` to the labels `y` of the embeddings `X` of `rows` with AdamW and a one-cycle schedule. """
+    device = ifnone(device, defaults.device)
+    head = head.to(device).train()
+    opt = torch.optim.AdamW(head.parameters(), lr=lr, weight_decay=wd)
+    sched = torch.optim.lr_scheduler.OneCycleLR(opt, max_lr=lr, total_steps=epochs * math.ceil(len(rows) / bs))
+    loss_func = nn.BCEWithLogitsLoss()
+    for epoch in range(epochs):
+        perm, total = np.random.permutation(rows), 0.
+        for i in range(0, len(perm), bs):
+            idx = perm[i:i+bs]
+            loss = loss_func(head(torch.from_numpy(X[idx]).to(device)), torch.from_numpy(y[idx]).to(device))
+            opt.zero_grad()
+            loss.backward()
+            opt.step()
+            sched.step()
+            total += loss.item() * len(idx)
+        logging.info(f"epoch {epoch}: train loss {total / len(perm):.5f}")
+    return head.eval()
+
+
+def head_preds(head, X, rows, bs=8192, device=None):
+    """Sigmoid outputs of `head` on the embeddings `X` of `rows`. """
+    device = ifnone(device, defaults.device)
+    head = head.to(device).eval()
+    with inference.inference_mode():
+        return np.concatenate([torch.sigmoid(head(torch.from_numpy(X[rows[i:i+bs]]).to(device))).cpu().numpy()
+                               for i in range(0, len(rows), bs)])
+
+
+def seq_log_loss(preds, seq_ids, train_labels):
+    """Sequence-level log loss of the frame predictions `preds`, aggregated like predict.py. """
+    agg = seqagg.SeqAggregator(seq_ids)
+    y_true = train_labels.loc[agg.seq_ids, registry.CLASSES].values
+    return inference.log_loss(y_true, agg.combine(preds, how="mean", per_class={14: "gmean"}))  # f15
+
+
+def train_head(stores, season, hidden=0, p=0.0, init=False, epochs=5, bs=1024, lr=1e-3, wd=1e-4):
+    """Trains a new head on the embeddings in `stores` (a stacker if there are several of them, or with `hidden`
+    units) on the training frames outside of the labeled `season`, and reports its log loss on `season`.
+    The backbones may have been trained on `season`, so only compare it between heads on the same stores. """
+    X = StackedEmbeddings(stores)
+    train_labels = pd.read_csv(path+"train_labels.csv", index_col="seq_id")
+    y = train_labels.loc[X.index.seq_id, registry.CLASSES].values.astype(np.float32)
+    holdout = X.index.seq_id.str.startswith(f"SER_{season}#").values
+    train_rows, valid_rows = np.flatnonzero(~holdout), np.flatnonzero(holdout)
+    valid_seqs = X.index.seq_id.values[valid_rows]
+
+    head = make_head(X.dim, hidden, p)
+    if init and not hidden and len(stores) == 1:
+        original = model_classifier(stores[0])
+        if original is not None: head.load_state_dict(original.state_dict())
+    results = {"stores": [s.path for s in stores], "dim": X.dim, "hidden": hidden, "season": season,
+               "train_frames": len(train_rows), "valid_frames": len(valid_rows)}
+
+    start = time.perf_counter()
+    head = fit_head(head, X, y, train_rows, epochs, bs, lr, wd)
+    results["fit_seconds"] = round(time.perf_counter() - start, 1)
+    results["log_loss"] = round(seq_log_loss(head_preds(head, X, valid_rows), valid_seqs, train_labels), 5)
+    return head, results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train a new head or stacker on the embeddings of extract_features.py")
+    parser.add_argument("stores", nargs="+", help="embedding stores, concatenated frame by frame")
+    parser.add_argument("--season", required=True,
+                        help="labeled season the head is evaluated on, left out of its training")
+    parser.add_argument("--hidden", type=int, default=0, help="hidden units of a two-layer stacker (default: linear)")
+    parser.add_argument("--dropout", type=float, default=0.0, help="dropout in front of the last layer of a stacker")
+    parser.add_argument("--init", action="store_true",
+                        help="start from the classifier of the registered model of a single store")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--wd", type=float, default=1e-4)
+    parser.add_argument("--output", default=None, help="weights of the head (default: head.pth in the first store)")
+    args = parser.parse_args()
+
+    stores = [embeddings.EmbeddingStore(s) for s in args.stores]
+    head, results = train_head(stores, args.season, args.hidden, args.dropout, args.init, args.epochs,
+                               args.batch_size, args.lr, args.wd)
+    output = ifnone(args.output, os.path.join(args.stores[0], "head.pth"))
+    torch.save(head.state_dict(), output)
+    with open(os.path.splitext(output)[0] + ".json", "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    logging.info(f"Head saved to {output}.")
@@ -1,5 +1,6 @@
 import logging
 import os.path as osp
+import sys
 from datetime import datetime
 from pathlib import Path
 
@@ -8,11 +9,15 @@ import pandas as pd
 import torch
 from PIL import Image
 from PIL import ImageFile
-from scipy.stats import gmean
 from torch.nn.modules.loss import _Loss
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
 from torchvision.models.resnet import resnext50_32x4d, resnext101_32x8d
 
+# numpy- and torch-only inference helpers shared with the 1st Place solution
+sys.path.append(str(Path(__file__).parents[3] / "1st Place"))
+from assets import journal, keyframes, seqagg, submission  # noqa: E402
+from assets.models import fold, layout  # noqa: E402
+
 # We get to see the log output for our execution, so log away!
 logging.basicConfig(level=logging.INFO)
 
@@ -36,7 +41,17 @@ CSV_FILENAME = "test_metadata.csv"
 
 BATCH_SIZE = 1
 IMG_SIZE = 360
+CHUNK_SIZE = 10000  # sequences scored between two checkpoints of the progress journal
 SOFTMAX = True  # flag to apply softmax or sigmoid at logits
+FRAME_BUDGET = None  # frames scored per sequence, the ones differing most from the background; None scores all
+assert FRAME_BUDGET is None or FRAME_BUDGET >= 1, "FRAME_BUDGET keeps at least 1 frame per sequence"
+FOLD_BN = True  # fold the BatchNorms into the convolutions before inference
+CHANNELS_LAST = False  # run the models in channels_last memory layout, on batches converted once in predict()
+INT8 = False  # run the int8 models written by quantize_models.py instead, which only run on the CPU
+DEVICE = "cpu" if INT8 else "cuda"
+if INT8:
+    # torch.ao.quantization needs torch>=1.13, the float models run on the pinned pytorch 1.2
+    from assets.models import quantize  # noqa: E402
 
 LABELS = [
     "aardvark",
@@ -96,13 +111,13 @@ LABELS = [
 ]
 
 
-def get_model(weight):
+def get_model(weight, device=DEVICE):
     weight = str(weight)
     if "101" in weight:
         model = resnext101_32x8d(num_classes=54)
     else:
         model = resnext50_32x4d(num_classes=54)
-    model = model.cuda()
+    model = model.to(device)
 
     print(weight)
     checkpoint = torch.load(weight, map_location="cpu")
@@ -132,11 +147,12 @@ def get_model(weight):
 
 
 class HakunaInferDataset:
-    def __init__(self, mode, data_path, long_side=IMG_SIZE):
+    def __init__(self, mode, data_path, long_side=IMG_SIZE, frame_budget=FRAME_BUDGET):
         assert mode in ["train", "val", "test"], f"unknown mode {mode}"
         self.path = data_path
         self.long_side = long_side
         self.mode = mode
+        self.frame_budget = frame_budget
 
         if self.mode == "test":
             # print(DATA_PATH)
@@ -185,8 +201,13 @@ class HakunaInferDataset:
 
         seq_id, group_df = self.groups[idx]
         batch["seq_id"] = seq_id
+        file_names = list(group_df["file_name"])
+        if self.frame_budget is not None and len(file_names) > self.frame_budget:
+            thumbs = [keyframes.thumbnail(osp.join(str(self.path), f)) for f in file_names]
+            file_names = [file_names[i] for i in keyframes.top_k(thumbs, self.frame_budget)]
+
         images1, images2 = [], []
-        for file_name in group_df["file_name"]:
+        for file_name in file_names:
             img1, img2 = self.get_image(osp.join(str(self.path), file_name))
             images1.append(img1)
             images2.append(img2)
@@ -294,29 +315,15 @@ class AverageMeter(object):
 
 
 @torch.no_grad()
-def perform_inference():
-    """This is the main function executed at runtime in the cloud environment. """
-    logging.info("Loading model.")
-
-    models = []
-    for path in [MODEL_PATH1, MODEL_PATH2]:
-        # models.append(torch.jit.load(str(path)).cuda())
-        models.append(get_model(path))
-        logging.info(f"Loading and processing metadata. {path}")
-
-    # Instantiate test data loader
-    test_dataset = HakunaInferDataset(mode="test", data_path=DATA_PATH)
-    test_dataloader = DataLoader(test_dataset, num_workers=6, batch_size=BATCH_SIZE)
+def predict(models, dataset, device=DEVICE):
+    """Sequence predictions for every item of `dataset`, computed on `device` """
+    test_dataloader = DataLoader(dataset, num_workers=6, batch_size=BATCH_SIZE)
 
-    logging.info("Starting inference.")
-
-    # Preallocate prediction output
-    submission_format = pd.read_csv(DATA_PATH / "submission_format.csv", index_col=0)
-    num_labels = submission_format.shape[1]
-    predict_output = np.zeros((len(test_dataset), num_labels))
+    # Sigmoid outputs of every model on every frame and its mirror, keyed by sequence index.
+    # All models see the same number of rows per sequence, so one gmean over these rows equals
+    # the gmean over models of the per-model gmeans.
+    frame_preds, frame_seqs = [], []
 
-    # Perform (and time) inference
-    inference_start = datetime.now()
     t0 = datetime.now()
     losses = AverageMeter()
     criterion = MultiLabelSoftMarginLoss()
@@ -326,21 +333,18 @@ def perform_inference():
             logging.info(f"{losses.avg:0.5f}")
             t0 = datetime.now()
 
-        outputs = []
         # for model in models:
 
         for i in range(2):
             imgs = batch[f"images{i+1}"][0]  # .type(torch.FloatTensor).cuda()
             mirror = torch.flip(imgs, (3,))
-            imgs_mirror = torch.cat([imgs, mirror], dim=0).type(torch.FloatTensor).cuda()
+            imgs_mirror = torch.cat([imgs, mirror], dim=0).type(torch.FloatTensor).to(device)
+            if CHANNELS_LAST:
+                imgs_mirror = imgs_mirror.contiguous(memory_format=torch.channels_last)
 
             output = torch.sigmoid(models[i](imgs_mirror))
-            arr = output.cpu().numpy()
-            model_predict = gmean(arr, axis=0)
-            outputs.append(model_predict)
-
-        mean_arr = np.array(outputs)
-        preds = gmean(mean_arr, axis=0)
+            frame_preds.append(output.cpu().numpy())
+            frame_seqs.extend([idx] * len(output))
 
         # targets = batch["label"].cuda()
         # output = torch.from_numpy(preds).cuda().unsqueeze(0)
@@ -350,31 +354,78 @@ def perform_inference():
         # reduced_loss = loss.data
         # losses.update(to_python_float(reduced_loss), 1)
 
-        predict_output[BATCH_SIZE * idx : BATCH_SIZE * (idx + 1)] = preds
-
     # logging.info(f"final {losses.avg:0.5f}")
 
-    inference_stop = datetime.now()
-    logging.info(f"Inference complete. Took {inference_stop - inference_start}.")
-    logging.info("Creating submission.")
+    agg = seqagg.SeqAggregator(frame_seqs)
+    return agg(np.concatenate(frame_preds), how=("gmean",))["gmean"]
 
-    # Check our predictions are in the same order as the submission format
-    # assert np.all(
-    #     test_metadata.seq_id.unique().tolist() == submission_format.index.to_list()
-    # )
 
-    my_submission = pd.DataFrame(
-        predict_output,
-        # Remember that we are predicting at the sequence, not image level
-        index=test_dataset.test_metadata.seq_id,
-        columns=submission_format.columns,
-    )
+@torch.no_grad()
+def perform_inference():
+    """This is the main function executed at runtime in the cloud environment. """
+    logging.info("Loading model.")
 
-    # We want to ensure all of our data are floats, not integers
-    my_submission = my_submission.astype(np.float)
+    models = []
+    model_paths = [MODEL_PATH1, MODEL_PATH2]
+    if INT8:
+        model_paths = [quantize.int8_path(path) for path in model_paths]
+    for path in model_paths:
+        # models.append(torch.jit.load(str(path)).cuda())
+        if INT8:
+            model = quantize.load_int8(path)
+        else:
+            model = get_model(path)
+            if FOLD_BN:
+                fold.fold_batchnorm(model)
+            if CHANNELS_LAST:
+                layout.to_channels_last(model)
+        models.append(model)
+        logging.info(f"Loading and processing metadata. {path}")
+
+    # Instantiate test data
+    test_dataset = HakunaInferDataset(mode="test", data_path=DATA_PATH)
+    seq_ids = test_dataset.test_metadata.seq_id
+
+    submission_format = pd.read_csv(DATA_PATH / "submission_format.csv", index_col=0)
+    writer = submission.SubmissionWriter(LABELS, submission_format.columns)
+
+    # chunks recorded in the journal by a previous, interrupted run are not computed again
+    run_config = {
+        "img_size": IMG_SIZE,
+        "chunk_size": CHUNK_SIZE,
+        "softmax": SOFTMAX,
+        "digits": writer.digits,
+        "frame_budget": FRAME_BUDGET,
+        "fold_bn": FOLD_BN,
+        "channels_last": CHANNELS_LAST,
+        "int8": INT8,
+    }
+    fingerprint = journal.fingerprint(model_paths, run_config)
+    progress = journal.InferenceJournal("submission.csv", fingerprint)
 
-    # Save out submission to root of directory
-    my_submission.to_csv("submission.csv", index=True)
+    logging.info("Starting inference.")
+
+    # Perform (and time) inference
+    inference_start = datetime.now()
+    for chunk, start in enumerate(range(0, len(test_dataset), CHUNK_SIZE)):
+        chunk_seq_ids = seq_ids[start : start + CHUNK_SIZE]
+        if progress.is_done(chunk, chunk_seq_ids):
+            logging.info(f"chunk {chunk}: done in a previous run")
+            continue
+
+        chunk_dataset = Subset(test_dataset, range(start, start + len(chunk_seq_ids)))
+        predict_output = predict(models, chunk_dataset)
+
+        # Save out submission to root of directory
+        # Remember that we are predicting at the sequence, not image level
+        header = progress.start(chunk)
+        with open("submission.csv", "ab") as f:
+            writer.write(f, predict_output, chunk_seq_ids.values, header=header)
+        progress.commit(chunk, chunk_seq_ids)
+        logging.info(f"chunk {chunk} saved.")
+
+    inference_stop = datetime.now()
+    logging.info(f"Inference complete. Took {inference_stop - inference_start}.")
     logging.info(f"Submission saved.")
 
 
@@ -0,0 +1,69 @@
+"""Int8 post-training quantization of the two ResNeXts of main.py, run with main.INT8 = True.
+
+See assets/models/quantize.py of the 1st Place solution for the quantization itself.
+"""
+import argparse
+import json
+import logging
+
+import numpy as np
+import torch
+from torch.utils.data import Subset
+
+from main import DATA_PATH, LABELS, MODEL_PATH1, MODEL_PATH2, HakunaInferDataset, get_model, predict
+from assets.models import quantize  # on the path set up by main
+
+
+def mirrored_batches(dataset, key, indices):
+    """Frames of the sequences `indices` of `dataset` stacked with their mirrors, as `predict` feeds them"""
+    for idx in indices:
+        imgs = dataset[idx][key]
+        yield torch.cat([imgs, torch.flip(imgs, (3,))], dim=0).type(torch.FloatTensor)
+
+
+def quantize_models(calib_seqs=64, eval_seqs=256, backend=quantize.BACKEND, iters=10, seed=0):
+    """Quantizes both models, calibrated on `calib_seqs` random validation sequences, and saves them next to their
+    weights. Reports their latency on a sequence and the log loss of their blend before and after, in total and per
+    class, on `eval_seqs` other validation sequences."""
+    dataset = HakunaInferDataset(mode="val", data_path=DATA_PATH)
+    order = np.random.RandomState(seed).permutation(len(dataset))
+    calib, holdout = order[:calib_seqs], order[calib_seqs : calib_seqs + eval_seqs]
+
+    models, int8_models, results = [], [], {}
+    for i, path in enumerate([MODEL_PATH1, MODEL_PATH2]):
+        key = f"images{i + 1}"
+        logging.info(f"{path}: calibrating on {len(calib)} sequences with the {backend} backend.")
+        example = next(mirrored_batches(dataset, key, calib[:1]))
+        quantized = quantize.quantize_model(get_model(path, "cpu"), mirrored_batches(dataset, key, calib), example,
+                                            backend)
+        fname = quantize.int8_path(path)
+        quantize.save_int8(quantized, fname, backend)
+        logging.info(f"int8 model saved to {fname}.")
+        models.append(get_model(path, "cpu"))
+        int8_models.append(quantized)
+        results[path.name] = {"artifact": fname, "backend": backend, "frames": len(example),
+                              **quantize.benchmark(models[-1], quantized, example, iters)}
+
+    subset = Subset(dataset, holdout)
+    y_true = np.stack([dataset.labels[dataset.seq2index[dataset.groups[idx][0]]] for idx in holdout])
+    results["blend"] = {"sequences": len(holdout),
+                        **quantize.log_loss_deltas(LABELS, y_true, predict(models, subset, "cpu"),
+                                                   predict(int8_models, subset, "cpu"))}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantize the models of main.py to int8 for CPU inference")
+    parser.add_argument("--calib-seqs", type=int, default=64, help="validation sequences to calibrate on")
+    parser.add_argument("--eval-seqs", type=int, default=256, help="other validation sequences to report on")
+    parser.add_argument("--backend", default=quantize.BACKEND, choices=torch.backends.quantized.supported_engines)
+    parser.add_argument("--threads", type=int, default=None, help="torch threads")
+    parser.add_argument("--report", default="quantization_report.json")
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    results = quantize_models(args.calib_seqs, args.eval_seqs, args.backend)
+    with open(args.report, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))